@@ -0,0 +1,140 @@
+# Benchmarks of the dkc3 text editor stages on a synthetic ROM
+# Results are written as JSON so runs can be compared over time.
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import dkc3_texteditor
+from dkc3_texteditor import LAYOUTS, compiled_table, extraction, get_layout, insertion, run_extract, run_insert
+
+from synthetic_rom import make_fixture, make_scripts, tbl_path
+
+def measure(func, repeat):
+    """
+    Runs func repeat times with stdout silenced.
+
+    Returns:
+        tuple: (best seconds, mean seconds, last result)
+    """
+    timings = []
+    result = None
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            result = func()
+            timings.append(time.perf_counter() - start)
+    return min(timings), sum(timings) / len(timings), result
+
+def record(results, name, lang, scale, best, mean, symbols=None):
+    entry = {"name": name, "lang": lang, "scale": scale, "best_s": best, "mean_s": mean}
+    if symbols is not None:
+        entry["symbols"] = symbols
+        entry["symbols_per_s"] = symbols / best if best else None
+    results.append(entry)
+    rate = f", {entry['symbols_per_s']:.0f} symbols/s" if symbols else ""
+    print(f"{name:<18} {lang:<3} x{scale:<5} best {best * 1000:9.3f} ms, mean {mean * 1000:9.3f} ms{rate}")
+
+def bench_tables(results, repeat):
+    for lang in LAYOUTS:
+        best, mean, _ = measure(lambda: compiled_table(compiled_table.parse(tbl_path(lang))), repeat)
+        record(results, "compile_table", lang, 1, best, mean)
+        best, mean, _ = measure(lambda: extraction.read_tbl(tbl_path(lang)), repeat)
+        record(results, "extract.read_tbl", lang, 1, best, mean)
+        best, mean, _ = measure(lambda: insertion.read_tbl(tbl_path(lang)), repeat)
+        record(results, "insert.read_tbl", lang, 1, best, mean)
+
+def bench_codec(results, fixture, scales, repeat):
+    """
+    Times encode_text, huffman_compress and huffman_decompress on scaled scripts.
+
+    The compressed text is decoded from an in-memory image (tree region followed
+    by the text), so the script size is not bound by the ROM text region.
+    """
+    with open(fixture["rom"], "rb") as f:
+        rom = f.read()
+
+    for lang in LAYOUTS:
+        layout = get_layout(lang)
+        tree_data = rom[layout["TREE_START_OFFSET"]:layout["TREE_START_OFFSET"] + layout["TREE_SIZE"]]
+        char_table, _ = insertion.read_tbl(tbl_path(lang))
+        trie = insertion.build_trie(char_table)
+        tbl_dict = extraction.read_tbl(tbl_path(lang))
+
+        for scale in scales:
+            scripts = ["".join(lines) for lines in make_scripts(lang, random.Random(scale), scale)]
+
+            best, mean, encoded = measure(lambda: insertion.encode_text(scripts, trie), repeat)
+            symbols = sum(len(block) for block in encoded)
+            record(results, "encode_text", lang, scale, best, mean, symbols)
+
+            best, mean, compressed = measure(lambda: insertion.huffman_compress(encoded, tree_data, 0, len(tree_data), len(tree_data)), repeat)
+            record(results, "huffman_compress", lang, scale, best, mean, symbols)
+
+            image = tree_data + bytes(compressed[0]) + bytes(2)
+            offsets, lengths = compressed[3], compressed[2]
+            best, mean, _ = measure(lambda: extraction.huffman_decompress(image, tbl_dict, 0, len(tree_data), offsets, lengths), repeat)
+            record(results, "huffman_decompress", lang, scale, best, mean, symbols)
+
+def bench_round_trip(results, fixture, work_dir, repeat):
+    """
+    Times full extract and insert runs of every language on the synthetic ROM.
+    """
+    langs = list(LAYOUTS)
+    tbl_file = os.path.join(os.path.dirname(tbl_path("en")), "dkc3_{lang}.tbl")
+    out_base = os.path.join(work_dir, "extracted", "script")
+    os.makedirs(os.path.dirname(out_base), exist_ok=True)
+    rom_copy = os.path.join(work_dir, "insert.sfc")
+    shutil.copyfile(fixture["rom"], rom_copy)
+    script_base = os.path.join(os.path.dirname(fixture["scripts"]["en"]), "script")
+
+    best, mean, stats = measure(lambda: run_extract(fixture["rom"], tbl_file, out_base, langs), repeat)
+    record(results, "extract", "all", 1, best, mean, stats["symbols"])
+    best, mean, stats = measure(lambda: run_insert(rom_copy, tbl_file, script_base, langs), repeat)
+    record(results, "insert", "all", 1, best, mean, stats["symbols"])
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks of the dkc3 text editor on a synthetic ROM")
+    parser.add_argument("-o", "--output", default="bench_results.json", help="JSON results file (default: bench_results.json)")
+    parser.add_argument("--scales", default="1,4,16", help="Script size multipliers of the codec benchmarks (default: 1,4,16)")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs of every benchmark, the best one is kept (default: 5)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic ROM (default: 0)")
+    args = parser.parse_args()
+
+    scales = [float(scale) for scale in args.scales.split(",")]
+    results = []
+    work_dir = tempfile.mkdtemp(prefix="dkc3_bench_")
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            fixture = make_fixture(os.path.join(work_dir, "fixture"), args.seed)
+        bench_tables(results, args.repeat)
+        bench_codec(results, fixture, scales, args.repeat)
+        bench_round_trip(results, fixture, work_dir, args.repeat)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "numpy": dkc3_texteditor.np is not None,
+        "seed": args.seed,
+        "repeat": args.repeat,
+        "results": results,
+    }
+    with open(args.output, "w", encoding="UTF-8") as f:
+        json.dump(report, f, indent=1)
+    print(f"Results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+# Round-trip fuzzing and throughput of the Huffman compressor/decompressor
+# Random symbol streams are compressed with insertion.huffman_compress and decoded
+# back with extraction.huffman_decompress on synthetic trees, so no ROM is needed.
+# Results are written as JSON like bench.py, the exit code is 1 on any mismatch.
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import dkc3_texteditor
+from dkc3_texteditor import extraction, huffman_table, insertion
+
+# Symbols 1-4 are line breaks, the lines of the decoder are compared too
+LINE_BREAKS = (1, 2, 3, 4)
+
+def make_trees(rng):
+    """
+    Builds the synthetic trees of the fuzzer.
+
+    Returns:
+        dict[str, bytearray]: Tree name -> tree region (root word + nodes).
+    """
+    symbols = rng.sample(range(256), 90)
+    frequencies = {symbol: rng.randint(1, 1000) for symbol in symbols}
+    frequencies.update({symbol: rng.randint(1, 1000) for symbol in LINE_BREAKS})
+    return {
+        # Dialogue-like tree, codes of 2-10 bits
+        "random": insertion.build_tree(insertion.limited_code_lengths(frequencies, 16)),
+        # Lengths 1, 2, ..., 16, 16: every code length up to the 16-bit maximum
+        "deep": insertion.build_tree({symbol: min(depth, 16) for depth, symbol in enumerate(rng.sample(range(5, 256), 17), start=1)}),
+        # 1-bit codes only, every word ends exactly after 16 symbols
+        "flat": insertion.build_tree({0x01: 1, 0x41: 1}),
+        # 256 symbols of 8 bits, two symbols per word
+        "full": insertion.build_tree({symbol: 8 for symbol in range(256)}),
+    }
+
+def edge_blocks(symbol_lut, rng):
+    """
+    Blocks for the word boundary cases of the packer and the decoder.
+
+    Returns:
+        list[tuple]: (case name, block)
+    """
+    by_length = {}
+    for symbol, (bits, _) in symbol_lut.items():
+        by_length.setdefault(bits, []).append(symbol)
+    shortest = by_length[min(by_length)][0]
+    longest = by_length[max(by_length)][0]
+    cases = [
+        ("empty", bytearray()),
+        ("single_shortest", bytearray([shortest])),
+        ("single_longest", bytearray([longest])),
+        ("longest_run", bytearray([longest]) * 33),
+    ]
+    # A code ending on every bit of a word, then a code straddling the next word
+    for bits in sorted(by_length):
+        fill = (16 - bits % 16) % 16
+        prefix = bytearray([shortest]) * (fill // symbol_lut[shortest][0])
+        cases.append((f"straddle_{bits}", prefix + bytearray([by_length[bits][0], longest, longest])))
+    # Exactly one full word, then one bit more
+    word = bytearray()
+    while sum(symbol_lut[symbol][0] for symbol in word) < 16:
+        word.append(rng.choice(list(symbol_lut)))
+    cases.append(("word_boundary", word))
+    cases.append(("word_boundary_plus", word + bytearray([shortest])))
+    return cases
+
+def round_trip(tree_data, blocks):
+    """
+    Compresses blocks with the tree and decodes them back from an in-memory image
+    (tree region followed by the text).
+
+    Returns:
+        tuple: (errors, compress seconds, decompress seconds)
+            errors (list[tuple]): (block index, message) of every mismatching block.
+    """
+    start = time.perf_counter()
+    compressed, _, lengths, offsets = insertion.huffman_compress(blocks, tree_data, 0, len(tree_data), len(tree_data))
+    compress_time = time.perf_counter() - start
+
+    # The decoder reads the word after the last block, in the ROM it's whatever follows the text
+    image = bytes(tree_data) + bytes(compressed) + bytes(2)
+    start = time.perf_counter()
+    lines = extraction.huffman_decompress(image, {}, 0, len(tree_data), offsets, lengths)
+    decompress_time = time.perf_counter() - start
+
+    errors = []
+    table = huffman_table(tree_data)
+    symbol_text = [f"<{symbol:02X}>" for symbol in range(256)]
+    for block_idx, block in enumerate(blocks):
+        if lengths[block_idx] != len(block):
+            errors.append((block_idx, f"{lengths[block_idx]} symbols packed, {len(block)} expected"))
+            continue
+        symbols = extraction.decode_symbols(image, table, offsets[block_idx], len(block))
+        if bytes(symbols) != bytes(block):
+            first = next((i for i, (a, b) in enumerate(zip(symbols, block)) if a != b), min(len(symbols), len(block)))
+            errors.append((block_idx, f"symbols differ from symbol {first}"))
+        elif lines[block_idx] != extraction.symbols_to_lines(block, symbol_text):
+            errors.append((block_idx, "lines differ"))
+    return errors, compress_time, decompress_time
+
+def verify_blocks(tree_data, blocks):
+    """
+    Checks every block alone with insertion.verify_task, as insert --verify does:
+    on the packed text only, so a block that ends on a word boundary is the last
+    data the decoder gets.
+
+    Returns:
+        list[tuple]: (block index, message) of every block that doesn't verify.
+    """
+    table = huffman_table(tree_data)
+    errors = []
+    for block_idx, block in enumerate(blocks):
+        compressed, _, lengths, offsets = insertion.huffman_compress([block], tree_data, 0, len(tree_data), 0)
+        ptr_table, _ = insertion.create_4_bytes_pointers(lengths, offsets)
+        errors.extend((block_idx, message) for message in insertion.verify_task("fuzz", table, bytes(compressed), bytes(ptr_table), {1: block}, {}))
+    return errors
+
+def compare_packers(symbol_lut, blocks):
+    """
+    Packs blocks with the Python and NumPy packers.
+
+    Returns:
+        tuple: (errors, python seconds, numpy seconds), numpy seconds is None without NumPy.
+            errors (list[tuple]): (block index, message) of every mismatching block.
+    """
+    start = time.perf_counter()
+    python_blocks = [insertion.compress_block_python(block, symbol_lut, i) for i, block in enumerate(blocks, start=1)]
+    python_time = time.perf_counter() - start
+    if dkc3_texteditor.np is None:
+        return [], python_time, None
+
+    start = time.perf_counter()
+    numpy_blocks = [insertion.compress_block_numpy(block, symbol_lut, i) for i, block in enumerate(blocks, start=1)]
+    numpy_time = time.perf_counter() - start
+    errors = [(i, "NumPy and Python packers differ")
+              for i, (python_block, numpy_block) in enumerate(zip(python_blocks, numpy_blocks))
+              if bytes(python_block[0]) != bytes(numpy_block[0]) or python_block[1] != numpy_block[1]]
+    return errors, python_time, numpy_time
+
+def rate(symbols, seconds):
+    return symbols / seconds if seconds else None
+
+def main():
+    parser = argparse.ArgumentParser(description="Round-trip fuzzing and throughput of the Huffman codec on synthetic trees")
+    parser.add_argument("-o", "--output", default="fuzz_results.json", help="JSON results file (default: fuzz_results.json)")
+    parser.add_argument("--sizes", default="0,1,16,255,256,4096,65536", help="Symbols per block of the random blocks (default: 0,1,16,255,256,4096,65536)")
+    parser.add_argument("--iterations", type=int, default=20, help="Random blocks of every size and tree (default: 20)")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed (default: 0)")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    sizes = [int(size) for size in args.sizes.split(",")]
+    results = []
+    failures = []
+
+    for tree_name, tree_data in make_trees(rng).items():
+        symbol_lut = insertion.build_symbol_lut(tree_data, 0)
+        tree_symbols = list(symbol_lut)
+
+        cases = edge_blocks(symbol_lut, rng)
+        with contextlib.redirect_stdout(io.StringIO()):
+            errors, _, _ = round_trip(tree_data, [block for _, block in cases])
+            errors += verify_blocks(tree_data, [block for _, block in cases])
+            errors += compare_packers(symbol_lut, [block for _, block in cases])[0]
+        failures.extend(f"{tree_name} {cases[block_idx][0]}: {message}" for block_idx, message in errors)
+        print(f"{tree_name:<7} edge cases    {'OK' if not errors else 'FAILED':<6} {len(cases)} blocks")
+
+        for size in sizes:
+            blocks = [bytearray(rng.choice(tree_symbols) for _ in range(size)) for _ in range(args.iterations)]
+            symbols = size * len(blocks)
+            with contextlib.redirect_stdout(io.StringIO()):
+                errors, compress_time, decompress_time = round_trip(tree_data, blocks)
+                packer_errors, python_time, numpy_time = compare_packers(symbol_lut, blocks)
+            errors += packer_errors
+            failures.extend(f"{tree_name} size {size} block {block_idx + 1}: {message}" for block_idx, message in errors)
+            entry = {
+                "tree": tree_name, "size": size, "blocks": len(blocks), "symbols": symbols, "ok": not errors,
+                "compress_s": compress_time, "compress_symbols_per_s": rate(symbols, compress_time),
+                "decompress_s": decompress_time, "decompress_symbols_per_s": rate(symbols, decompress_time),
+                "python_packer_symbols_per_s": rate(symbols, python_time),
+                "numpy_packer_symbols_per_s": rate(symbols, numpy_time) if numpy_time is not None else None,
+            }
+            results.append(entry)
+            numpy_rate = f", numpy {entry['numpy_packer_symbols_per_s']:.0f}/s" if entry["numpy_packer_symbols_per_s"] else ""
+            print(f"{tree_name:<7} size {size:<8} {'OK' if not errors else 'FAILED':<6} "
+                  f"compress {entry['compress_symbols_per_s'] or 0:.0f}/s, decompress {entry['decompress_symbols_per_s'] or 0:.0f}/s{numpy_rate}")
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "numpy": dkc3_texteditor.np is not None,
+        "seed": args.seed,
+        "iterations": args.iterations,
+        "failures": failures,
+        "results": results,
+    }
+    with open(args.output, "w", encoding="UTF-8") as f:
+        json.dump(report, f, indent=1)
+    for failure in failures:
+        print(f"[ERROR] {failure}")
+    print(f"Results written to {args.output}")
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
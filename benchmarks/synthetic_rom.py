@@ -0,0 +1,126 @@
+# Synthetic ROM fixture for the dkc3 text editor benchmarks
+# Builds a headerless 4 MB image with the same layout as the USA ROM (LAYOUTS),
+# a Huffman tree per language, the pointer tables and the compressed scripts.
+
+import argparse
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from dkc3_texteditor import LAYOUTS, get_layout, insertion, run_insert
+
+ROM_SIZE = 0x400000
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+CONTROL_CODES = ["<01>", "<02>", "<03>", "<04>"]
+
+def tbl_path(lang):
+    return os.path.join(REPO_DIR, f"dkc3_{lang}.tbl")
+
+def script_alphabet(lang):
+    """
+    Returns the single characters of the language table the synthetic script can use.
+
+    The alphabet is cut so the tree (4 control codes included) fits the tree region.
+    """
+    layout = get_layout(lang)
+    max_symbols = (layout["TREE_SIZE"] - 2 + 5) // 10
+    char_table, _ = insertion.read_tbl(tbl_path(lang))
+    chars = [
+        chars for chars, byte_key in sorted(char_table.items(), key=lambda item: item[1])
+        if len(chars) == 1 and len(byte_key) == 1 and chars not in ";@|&<"
+    ]
+    return chars[:max_symbols - len(CONTROL_CODES)]
+
+def make_scripts(lang, rng, scale=1.0, blocks=20):
+    """
+    Generates word-like dialogue for every block.
+
+    Parameters:
+        lang (str): Language of the layout and table.
+        rng (random.Random): Random source.
+        scale (float): Multiplier of the number of lines per block.
+        blocks (int): Number of blocks.
+
+    Returns:
+        list[list[str]]: The lines of every block.
+    """
+    alphabet = script_alphabet(lang)
+    letters = [char for char in alphabet if char.isalpha()] or alphabet
+    others = [char for char in alphabet if char not in letters and char != " "]
+    scripts = []
+    for _ in range(blocks):
+        lines = []
+        for _ in range(max(1, int(rng.randint(20, 45) * scale))):
+            words = []
+            for _ in range(rng.randint(1, 8)):
+                words.append("".join(rng.choice(letters) for _ in range(rng.randint(1, 9))))
+            line = rng.choice(CONTROL_CODES) + " ".join(words)
+            if others and rng.random() < 0.5:
+                line += rng.choice(others)
+            lines.append(line)
+        scripts.append(lines)
+    return scripts
+
+def write_scripts(base, scripts):
+    """
+    Writes the blocks in the extraction format (<base>_<n>.txt).
+    """
+    for i, lines in enumerate(scripts, start=1):
+        with open(f"{base}_{i}.txt", "w", encoding="UTF-8") as f:
+            f.write(";{00000000-00000000-00000000}\n")
+            for n, line in enumerate(lines, start=1):
+                f.write(f"@{n}\n;{{{line}}}\n{line}\n|\n")
+
+def make_fixture(directory, seed=0, scale=1.0):
+    """
+    Builds the synthetic ROM and its scripts in directory.
+
+    Returns:
+        dict: Paths of the fixture: "rom", "scripts" ({lang: base}) and "tbl" ({lang: path}).
+    """
+    os.makedirs(directory, exist_ok=True)
+    rng = random.Random(seed)
+    rom_file = os.path.join(directory, "synthetic.sfc")
+    rom = bytearray(ROM_SIZE)
+    fixture = {"rom": rom_file, "scripts": {}, "tbl": {}}
+
+    for lang in LAYOUTS:
+        layout = get_layout(lang)
+        scripts = make_scripts(lang, rng, scale)
+        base = os.path.join(directory, f"script_{lang}")
+        write_scripts(base, scripts)
+
+        # Tree built from the frequencies of the generated text
+        char_table, _ = insertion.read_tbl(tbl_path(lang))
+        # The extra block holds every symbol once, so scaled scripts never miss one
+        all_symbols = "".join(script_alphabet(lang) + CONTROL_CODES)
+        encoded = insertion.encode_text(["".join(lines) for lines in scripts] + [all_symbols], insertion.build_trie(char_table))
+        tree_data = insertion.rebuild_tree(encoded, layout["TREE_SIZE"])
+        rom[layout["TREE_START_OFFSET"]:layout["TREE_START_OFFSET"] + len(tree_data)] = tree_data
+
+        fixture["scripts"][lang] = base
+        fixture["tbl"][lang] = tbl_path(lang)
+
+    with open(rom_file, "wb") as f:
+        f.write(rom)
+
+    # Text and pointer tables are written by the editor itself
+    for lang in LAYOUTS:
+        run_insert(rom_file, fixture["tbl"][lang], fixture["scripts"][lang], [lang])
+
+    return fixture
+
+def main():
+    parser = argparse.ArgumentParser(description="Builds a synthetic DKC3 ROM with scripts for every language")
+    parser.add_argument("directory", help="Output folder")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed (default: 0)")
+    parser.add_argument("--scale", type=float, default=1.0, help="Script size multiplier (default: 1.0)")
+    args = parser.parse_args()
+
+    fixture = make_fixture(args.directory, args.seed, args.scale)
+    print(f"Synthetic ROM written to {fixture['rom']}")
+
+if __name__ == "__main__":
+    main()
@@ -4,8 +4,111 @@
 import argparse
 import sys
 import os
-import re
 import struct
+import mmap
+import json
+import hashlib
+import concurrent.futures
+import time
+import collections
+import contextlib
+import functools
+import tracemalloc
+import cProfile
+import tempfile
+import shutil
+import zlib
+import select
+import ctypes
+import ctypes.util
+import array
+import io
+import itertools
+import bisect
+import re
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+MANIFEST_VERSION = 1
+TREE_CACHE_VERSION = 2
+LINE_INDEX_VERSION = 1
+LAYOUT_CACHE_VERSION = 1
+# Layouts of unknown ROMs kept in the cache folder, keyed by CRC32
+LAYOUT_CACHE_ENTRIES = 64
+# Decoded trees kept in the cache folder, the least recently used ones are removed
+TREE_CACHE_ENTRIES = 16
+
+SCRIPT_BUFFER_SIZE = 1 << 16
+# Lines of a .txt script starting with these characters are comments/markers
+SCRIPT_SKIP_PREFIXES = frozenset(";@|&")
+SCRIPT_FORMATS = ("txt", "jsonl", "po")
+# Blocks with fewer symbols are packed in pure Python, NumPy setup costs more than it saves
+NUMPY_MIN_SYMBOLS = 256
+
+# ROM layout of every language (headerless ROM)
+LAYOUTS = {
+    "en": {
+        "PTR_START_OFFSET": 0x379DF5,
+        "PTR_END_OFFSET": 0x379E44,
+        # 75 different characters
+        "TREE_START_OFFSET": 0x379EE5,
+        "TREE_END_OFFSET": 0x37A1E4,
+        "TEXT_START_OFFSET": 0x3A0000,
+        "TEXT_END_OFFSET": 0x3A5392,
+        "TEXT_LIMIT": 0x5393,
+    },
+    "fr": {
+        "PTR_START_OFFSET": 0x379E45,
+        "PTR_END_OFFSET": 0x379E94,
+        # 90 different characters
+        "TREE_START_OFFSET": 0x37A1E5,
+        "TREE_END_OFFSET": 0x37A570,
+        "TEXT_START_OFFSET": 0x3A5393,
+        "TEXT_END_OFFSET": 0x3AA1B2,
+        # Insert allows the French script to grow past TEXT_END_OFFSET
+        "TEXT_LIMIT": 0x6000,
+    },
+}
+# Scripts of every language
+PTR_ENTRIES = 20
+
+# CRC32 of known ROMs (without copier header) and their layouts
+KNOWN_ROMS = {
+    0x448EEC19: LAYOUTS,
+}
+
+def get_cache_dir():
+    """
+    Returns the folder of the on-disk caches, or None when caching is disabled.
+
+    The folder is DKC3_CACHE_DIR when set (an empty value disables the caches),
+    ~/.cache/dkc3_texteditor otherwise.
+    """
+    cache_dir = os.environ.get("DKC3_CACHE_DIR")
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.expanduser("~"), ".cache", "dkc3_texteditor")
+    if not cache_dir:
+        return None
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+    except OSError:
+        return None
+    return cache_dir
+
+def write_cache_file(path, data):
+    """
+    Writes a cache file atomically, so concurrent runs never read a partial file.
+    """
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
 
 def reverse_list(lst, n=None):
     """
@@ -29,38 +132,511 @@ def reverse_list(lst, n=None):
     last_elem = lst[n-1]
     return to_reverse[::-1] + [last_elem]
 
-class extraction:
-    def __init__(self):
-        pass
-    
-    def read_rom(rom_file, addr, size):
+class rom_session:
+    """
+    ROM file opened once and shared by every extraction/insertion stage.
+
+    The file is memory-mapped, read() returns zero-copy memoryview slices and
+    write() only stages the data. Staged writes are applied together by flush(),
+    which the context manager calls when the block exits without errors.
+
+    With out_rom and/or patch_file, the ROM file is only read: flush() writes
+    a copy of the ROM with the staged data and/or an IPS/BPS patch of it.
+    """
+    def __init__(self, rom_file, writable=False, out_rom=None, patch_file=None):
+        self.rom_file = rom_file
+        self.writable = writable
+        self.out_rom = out_rom
+        self.patch_file = patch_file
+        self.in_place = writable and out_rom is None and patch_file is None
+        self.file = open(rom_file, "r+b" if self.in_place else "rb")
+        access = mmap.ACCESS_WRITE if self.in_place else mmap.ACCESS_READ
+        self.mmap = mmap.mmap(self.file.fileno(), 0, access=access)
+        self.data = memoryview(self.mmap)
+        self.pending = []
+        self.written = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+        self.close()
+        return False
+
+    def read(self, addr, size):
+        """
+        Returns a zero-copy view of size bytes starting at addr.
         """
-        Reads a block of data from the ROM file.
+        return self.data[addr:addr + size]
 
-        Parameters:
-            addr (int): The starting address to read from.
-            size (int): The number of bytes to read.
+    def write(self, addr, data):
+        """
+        Stages data to be written at addr on the next flush().
+        """
+        if not self.writable:
+            raise IOError(f"{self.rom_file} was opened read-only.")
+        self.pending.append((addr, bytes(data)))
+
+    def flush(self):
+        """
+        Applies every staged write to the ROM file, or to the output ROM and patch.
+        """
+        if not self.pending:
+            return
+        if self.in_place:
+            for addr, data in self.pending:
+                self.mmap[addr:addr + len(data)] = data
+            self.mmap.flush()
+            self.pending = []
+            return
+
+        # The source is never modified, the outputs are rebuilt from every write
+        self.written.extend(self.pending)
+        self.pending = []
+        writes = rom_patch.merge_writes(self.written)
+        if self.patch_file is not None:
+            rom_patch.write(self.patch_file, self.data, writes)
+        if self.out_rom is not None:
+            if os.path.abspath(self.out_rom) != os.path.abspath(self.rom_file):
+                shutil.copyfile(self.rom_file, self.out_rom)
+            with open(self.out_rom, "r+b") as f:
+                for addr, data in writes:
+                    f.seek(addr)
+                    f.write(data)
+
+    def close(self):
+        self.data.release()
+        try:
+            self.mmap.close()
+        except BufferError:
+            # Slices handed to the readers are still alive, the map is
+            # released once they are garbage collected.
+            pass
+        self.file.close()
+
+class rom_patch:
+    """
+    IPS and BPS patches of the staged writes of a rom_session.
+
+    Only the ranges covered by the writes are compared with the source ROM, the
+    patch is written record by record and the source is read in chunks, so no
+    copy of the ROM is kept in memory.
+    """
+    # Unchanged bytes between two records cost less than a new record header
+    IPS_MERGE_GAP = 5
+    BPS_MERGE_GAP = 2
+    IPS_MAX_RECORD = 0xFFFF
+    IPS_EOF = 0x454F46
+    CHUNK_SIZE = 0x10000
+
+    def merge_writes(writes):
+        """
+        Merges staged writes into sorted, non-overlapping (addr, data) ranges.
+        Later writes replace earlier ones where they overlap.
+        """
+        merged = []
+        for addr, data in writes:
+            end = addr + len(data)
+            keep = []
+            start, stop = addr, end
+            for other_addr, other_data in merged:
+                other_end = other_addr + len(other_data)
+                if other_end < addr or other_addr > end:
+                    keep.append((other_addr, other_data))
+                else:
+                    start = min(start, other_addr)
+                    stop = max(stop, other_end)
+            buffer = bytearray(stop - start)
+            for other_addr, other_data in merged:
+                if not (other_addr + len(other_data) < addr or other_addr > end):
+                    buffer[other_addr - start:other_addr - start + len(other_data)] = other_data
+            buffer[addr - start:end - start] = data
+            keep.append((start, bytes(buffer)))
+            merged = sorted(keep)
+        return merged
+
+    def diff_runs(source, writes, gap=0):
+        """
+        Yields (addr, data) for every run of written bytes that differ from the source.
+        Runs separated by at most gap unchanged bytes are joined.
+        """
+        for addr, data in writes:
+            old = source[addr:addr + len(data)]
+            run_start = None
+            run_end = None
+            for i in range(len(data)):
+                if i < len(old) and old[i] == data[i]:
+                    continue
+                if run_start is not None and i - run_end > gap:
+                    yield addr + run_start, data[run_start:run_end]
+                    run_start = None
+                if run_start is None:
+                    run_start = i
+                run_end = i + 1
+            if run_start is not None:
+                yield addr + run_start, data[run_start:run_end]
+
+    def write(patch_file, source, writes):
+        """
+        Writes an IPS or BPS patch, the format is taken from the file extension.
+        """
+        if patch_file.lower().endswith(".bps"):
+            rom_patch.write_bps(patch_file, source, writes)
+        else:
+            rom_patch.write_ips(patch_file, source, writes)
+
+    def write_ips(patch_file, source, writes):
+        """
+        Writes an IPS patch: "PATCH", records of 3-byte offset, 2-byte size and data, "EOF".
+        """
+        records = 0
+        with open(patch_file, "wb") as f:
+            f.write(b"PATCH")
+            for addr, data in rom_patch.diff_runs(source, writes, rom_patch.IPS_MERGE_GAP):
+                if addr == rom_patch.IPS_EOF:
+                    # This offset reads as the end marker, start one byte earlier
+                    addr -= 1
+                    data = bytes(source[addr:addr + 1]) + data
+                if addr + len(data) > 0xFFFFFF + 1:
+                    raise ValueError("IPS patches can't address more than 16 MiB, use a .bps patch")
+                for offset in range(0, len(data), rom_patch.IPS_MAX_RECORD):
+                    chunk = data[offset:offset + rom_patch.IPS_MAX_RECORD]
+                    f.write((addr + offset).to_bytes(3, "big") + len(chunk).to_bytes(2, "big"))
+                    f.write(chunk)
+                    records += 1
+            f.write(b"EOF")
+        print(f"IPS patch written to {patch_file}, {records} records.")
+
+    def bps_number(value):
+        """
+        Encodes a BPS variable-length number.
+        """
+        data = bytearray()
+        while True:
+            byte = value & 0x7F
+            value >>= 7
+            if value == 0:
+                data.append(0x80 | byte)
+                return data
+            data.append(byte)
+            value -= 1
+
+    def write_bps(patch_file, source, writes):
+        """
+        Writes a BPS patch. Unchanged ranges are SourceRead actions, changed ones
+        TargetRead actions, followed by the CRC32 of the source, target and patch.
+        Writes past the end of the source make the target larger,
+        bytes between them that were never written are zeros, like in a grown file.
+        """
+        size = len(source)
+        target_size = max([size] + [addr + len(data) for addr, data in writes])
+        source_crc = 0
+        target_crc = 0
+        patch_crc = 0
+        actions = 0
+        position = 0
+
+        with open(patch_file, "wb") as f:
+            def emit(data):
+                nonlocal patch_crc
+                patch_crc = zlib.crc32(data, patch_crc)
+                f.write(data)
+
+            def target_read(data):
+                nonlocal source_crc, target_crc, position, actions
+                emit(rom_patch.bps_number(((len(data) - 1) << 2) | 1))
+                emit(data)
+                # Only the part inside the source counts for its CRC
+                source_crc = zlib.crc32(source[position:position + len(data)], source_crc)
+                target_crc = zlib.crc32(data, target_crc)
+                position += len(data)
+                actions += 1
+
+            def source_read(end):
+                nonlocal source_crc, target_crc, position, actions
+                source_end = min(end, size)
+                if source_end > position:
+                    emit(rom_patch.bps_number(((source_end - position - 1) << 2) | 0))
+                    for offset in range(position, source_end, rom_patch.CHUNK_SIZE):
+                        chunk = source[offset:min(offset + rom_patch.CHUNK_SIZE, source_end)]
+                        source_crc = zlib.crc32(chunk, source_crc)
+                        target_crc = zlib.crc32(chunk, target_crc)
+                    position = source_end
+                    actions += 1
+                # There is nothing to copy past the end of the source
+                for offset in range(position, end, rom_patch.CHUNK_SIZE):
+                    target_read(bytes(min(rom_patch.CHUNK_SIZE, end - offset)))
+
+            emit(b"BPS1" + rom_patch.bps_number(size) + rom_patch.bps_number(target_size) + rom_patch.bps_number(0))
+            for addr, data in rom_patch.diff_runs(source, writes, rom_patch.BPS_MERGE_GAP):
+                source_read(addr)
+                target_read(data)
+            source_read(target_size)
+
+            emit(source_crc.to_bytes(4, "little") + target_crc.to_bytes(4, "little"))
+            f.write(patch_crc.to_bytes(4, "little"))
+        print(f"BPS patch written to {patch_file}, {actions} actions.")
+
+class huffman_table:
+    """
+    Multi-bit decode table for a Huffman tree stored in the ROM.
+
+    Tree format (offsets relative to the start of the region + 2):
+        [0]           Root node offset (little endian)
+        [node - 1]    Symbol byte of the node (used when the node is a leaf)
+        [node + 0]    Child taken when the bit is 1
+        [node + 2]    Child taken when the bit is 0
+
+    A child of 0 marks the current node as a leaf. The bit that hit the leaf is
+    not consumed, decoding restarts at the root with that same bit.
+
+    For every (node, byte) pair the table stores the symbols completed while
+    walking those 8 bits and the node where the walk stopped. Entries are filled
+    lazily, only the pairs present in the decoded text are ever computed.
+    """
+    def __init__(self, tree_data):
+        self.tree_data = bytes(tree_data)
+        self.tree_base = 2
+        self.root = self.get_ushort(0)
+        self.tables = {}
+
+    def get_ushort(self, index):
+        return self.tree_data[index] | (self.tree_data[index + 1] << 8)
+
+    def walk(self, node, byte, bits=8):
+        """
+        Walks the given number of bits (MSB first) of byte starting at node.
 
         Returns:
-            bytes: The data read from the ROM.
+            tuple: (symbols, node)
+                symbols (tuple[int]): Symbols completed during the walk.
+                node (int): Node offset where the next bit has to be applied.
         """
-        with open(rom_file, "rb") as f:
-            f.seek(addr)
-            return f.read(size)
+        symbols = []
+        mask = 1 << (bits - 1)
+        while mask:
+            child = self.get_ushort(self.tree_base + node + (0 if byte & mask else 2))
+            if child == 0:
+                symbols.append(self.tree_data[self.tree_base + node - 1])
+                if node == self.root:
+                    # Degenerate tree made of a single leaf, consume the bit
+                    mask >>= 1
+                node = self.root
+            else:
+                node = child
+                mask >>= 1
+        return tuple(symbols), node
 
-    def read_tbl(tbl_file):
+    def nodes(self):
         """
-        Loads the TBL (table) file into a dictionary mapping byte sequences to characters.
+        Returns every node reachable from the root (leaves included).
+        """
+        found = set()
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if node in found:
+                continue
+            found.add(node)
+            for child in (self.get_ushort(self.tree_base + node), self.get_ushort(self.tree_base + node + 2)):
+                if child != 0:
+                    stack.append(child)
+        return sorted(found)
+
+    def build_all(self):
+        """
+        Fills every entry of the table.
 
-        The table format should be one mapping per line in the form:
-        HEX=Character(s)
+        Each byte entry is composed from two 4-bit walks, so the tree is only
+        walked 16 times per node instead of 256.
+        """
+        nodes = self.nodes()
+        nibbles = {node: [self.walk(node, value, 4) for value in range(16)] for node in nodes}
+        for node in nodes:
+            table = self.tables.get(node)
+            if table is None:
+                table = self.tables[node] = [None] * 256
+            for high in range(16):
+                high_symbols, high_node = nibbles[node][high]
+                low_row = nibbles[high_node]
+                for low in range(16):
+                    low_symbols, low_node = low_row[low]
+                    table[(high << 4) | low] = (high_symbols + low_symbols, low_node)
+
+    def lookup(self, node, byte):
+        """
+        Returns the (symbols, node) entry for a node and an input byte.
+        """
+        table = self.tables.get(node)
+        if table is None:
+            table = self.tables[node] = [None] * 256
+        entry = table[byte]
+        if entry is None:
+            entry = table[byte] = self.walk(node, byte)
+        return entry
+
+class tree_cache:
+    """
+    Decoded Huffman trees stored in the cache folder.
+
+    Each file is keyed by the SHA-1 of the tree region and holds the compressor
+    SymbolLUT and the complete huffman_table entries. Files are touched when used
+    and only the TREE_CACHE_ENTRIES most recent ones are kept.
+
+    File format (little endian), arrays of numbers only so loading a file never
+    runs code:
+        "DKC3TREE", version (2), LUT symbols (2), decode nodes (2), symbol runs (4)
+        lut_symbols[symbols] (1), lut_bits[symbols] (1), lut_codes[symbols] (2),
+        run_lengths[runs] (1), run_symbols[sum of run_lengths] (1),
+        nodes[nodes] (2), next_nodes[nodes * 256] (2), entry_runs[nodes * 256] (4)
+    The symbols of a decode entry are one of the distinct symbol runs, stored
+    once. A count of 0 means the state has no LUT or no decode entries.
+    """
+    MAGIC = b"DKC3TREE"
+    HEADER = struct.Struct("<8sHHHI")
+
+    def path(digest):
+        cache_dir = get_cache_dir()
+        if cache_dir is None:
+            return None
+        return os.path.join(cache_dir, f"tree_{digest}.bin")
+
+    def read_column(f, typecode, count):
+        column = array.array(typecode)
+        column.fromfile(f, count)
+        if sys.byteorder == "big":
+            column.byteswap()
+        return column
+
+    def write_column(f, typecode, values):
+        column = array.array(typecode, values)
+        if sys.byteorder == "big":
+            column.byteswap()
+        column.tofile(f)
+
+    def load(digest):
+        """
+        Returns the cached state of a tree ({"lut": ..., "decode": ...}), or an empty dict.
+        """
+        path = tree_cache.path(digest)
+        if path is None or not os.path.exists(path):
+            return {}
+        state = {}
+        try:
+            with open(path, "rb") as f:
+                header = f.read(tree_cache.HEADER.size)
+                if len(header) != tree_cache.HEADER.size:
+                    return {}
+                magic, version, lut_count, node_count, run_count = tree_cache.HEADER.unpack(header)
+                if magic != tree_cache.MAGIC or version != TREE_CACHE_VERSION:
+                    return {}
+                if lut_count:
+                    lut_symbols = tree_cache.read_column(f, "B", lut_count)
+                    lut_bits = tree_cache.read_column(f, "B", lut_count)
+                    lut_codes = tree_cache.read_column(f, "H", lut_count)
+                    state["lut"] = {symbol: (bits, code) for symbol, bits, code in zip(lut_symbols, lut_bits, lut_codes)}
+                if node_count:
+                    run_lengths = tree_cache.read_column(f, "B", run_count)
+                    run_symbols = tree_cache.read_column(f, "B", sum(run_lengths)).tolist()
+                    ends = list(itertools.accumulate(run_lengths, initial=0))
+                    runs = [tuple(run_symbols[start:end]) for start, end in zip(ends, ends[1:])]
+                    nodes = tree_cache.read_column(f, "H", node_count)
+                    next_nodes = tree_cache.read_column(f, "H", node_count * 256)
+                    entry_runs = tree_cache.read_column(f, "I", node_count * 256)
+                    entries = list(zip(map(runs.__getitem__, entry_runs), next_nodes))
+                    state["decode"] = {node: entries[i * 256:(i + 1) * 256] for i, node in enumerate(nodes)}
+            os.utime(path)
+        except (OSError, EOFError, IndexError):
+            return {}
+        return state
+
+    def store(digest, state):
+        """
+        Writes the state of a tree and evicts the least recently used trees.
+        Decode tables that are not complete are not stored.
+        """
+        path = tree_cache.path(digest)
+        if path is None:
+            return
+        lut = state.get("lut", {})
+        decode = state.get("decode", {})
+        if any(entry is None for table in decode.values() for entry in table):
+            decode = {}
+
+        runs = {}
+        entry_runs = [runs.setdefault(symbols, len(runs)) for table in decode.values() for symbols, _ in table]
+
+        data = io.BytesIO()
+        data.write(tree_cache.HEADER.pack(tree_cache.MAGIC, TREE_CACHE_VERSION, len(lut), len(decode), len(runs)))
+        tree_cache.write_column(data, "B", lut)
+        tree_cache.write_column(data, "B", [bits for bits, _ in lut.values()])
+        tree_cache.write_column(data, "H", [code for _, code in lut.values()])
+        tree_cache.write_column(data, "B", [len(symbols) for symbols in runs])
+        tree_cache.write_column(data, "B", [symbol for symbols in runs for symbol in symbols])
+        tree_cache.write_column(data, "H", decode)
+        tree_cache.write_column(data, "H", [node for table in decode.values() for _, node in table])
+        tree_cache.write_column(data, "I", entry_runs)
+        write_cache_file(path, data.getvalue())
+
+        cache_dir = os.path.dirname(path)
+        try:
+            files = [os.path.join(cache_dir, name) for name in os.listdir(cache_dir)
+                     if name.startswith("tree_") and name.endswith(".bin")]
+            files.sort(key=os.path.getmtime, reverse=True)
+            for old_file in files[TREE_CACHE_ENTRIES:]:
+                os.remove(old_file)
+        except OSError:
+            pass
+
+class compiled_table:
+    """
+    A .tbl file compiled once for both directions.
+
+    Attributes:
+        decode_map (dict[bytes, str]): Byte sequence -> characters (extraction.read_tbl).
+        encode_map (dict[str, bytes]): Characters -> byte sequence (insertion.read_tbl).
+        chars_lengths (list[int]): Distinct character lengths, longest first.
+        symbols (list[str]): 256 slots with the text of every single-byte symbol,
+                             <XX> when the symbol is not in the table.
+        trie (dict): Encoding trie from insertion.build_trie.
+
+    symbols and trie are only built when first used, extract never needs the trie
+    and insert never needs the symbols. Parsing a table takes less time than
+    checking a cached copy, so tables are not stored in the cache folder.
+    """
+    def __init__(self, entries):
+        """
+        Parameters:
+            entries (list[tuple]): (byte sequence, characters) in file order.
+        """
+        self.decode_map = dict(entries)
+        self.encode_map = {chars: byte_key for byte_key, chars in entries}
+        self.chars_lengths = sorted({len(chars) for chars in self.encode_map if len(chars) > 0}, reverse=True)
+
+    # Key and placeholder text of every single-byte symbol
+    SYMBOL_KEYS = [bytes([symbol]) for symbol in range(256)]
+    SYMBOL_NAMES = [f"<{symbol:02X}>" for symbol in range(256)]
+
+    @functools.cached_property
+    def symbols(self):
+        return list(map(self.decode_map.get, compiled_table.SYMBOL_KEYS, compiled_table.SYMBOL_NAMES))
+
+    @functools.cached_property
+    def trie(self):
+        return insertion.build_trie(self.encode_map)
+
+    def parse(tbl_file):
+        """
+        Parses a .tbl file, one HEX=Character(s) mapping per line.
 
         Comments (lines starting with ';' or '/') and invalid lines are ignored.
 
         Returns:
-            dict[bytes, str]: A mapping of byte sequences to their character representation.
+            list[tuple]: (byte sequence, characters) in file order.
         """
-        char_table = {}
+        entries = []
         with open(tbl_file, "r", encoding="UTF-8") as f:
             for line in f:
                 if not line or line.startswith(";") or line.startswith("/"):
@@ -71,11 +647,51 @@ class extraction:
                         if len(hex_value) % 2 != 0:
                             print(f"Warning: '{hex_value}' is invalid! Skipped.")
                             continue
-                        byte_key = bytes.fromhex(hex_value)
-                        char_table[byte_key] = chars.strip("\n")
+                        entries.append((bytes.fromhex(hex_value), chars.strip("\n")))
                     except ValueError:
                         print(f"Warning: '{hex_value}' is invalid! Skipped.")
-        return char_table
+        return entries
+
+    def load(tbl_file):
+        """
+        Returns the compiled table of a .tbl file.
+        """
+        return compiled_table(compiled_table.parse(tbl_file))
+
+class extraction:
+    # shared_cache of a process pool worker, see init_worker
+    worker_cache = None
+
+    def __init__(self):
+        pass
+    
+    def read_rom(rom, addr, size):
+        """
+        Reads a block of data from the ROM.
+
+        Parameters:
+            rom (rom_session): The opened ROM.
+            addr (int): The starting address to read from.
+            size (int): The number of bytes to read.
+
+        Returns:
+            memoryview: The data read from the ROM.
+        """
+        return rom.read(addr, size)
+
+    def read_tbl(tbl_file):
+        """
+        Loads the TBL (table) file into a dictionary mapping byte sequences to characters.
+
+        The table format should be one mapping per line in the form:
+        HEX=Character(s)
+
+        Comments (lines starting with ';' or '/') and invalid lines are ignored.
+
+        Returns:
+            dict[bytes, str]: A mapping of byte sequences to their character representation.
+        """
+        return compiled_table.load(tbl_file).decode_map
 
     def read_ptr_table(data, base):
         """
@@ -110,72 +726,125 @@ class extraction:
 
         return positions, lengths
 
-    def huffman_decompress(rom_file, tbl_dict, tree_start, tree_size, ptr_start, script_length):
-        def get_ushort(data, index):
-            return data[index] | (data[index + 1] << 8)
+    def huffman_decompress(rom_data, tbl_dict, tree_start, tree_size, ptr_start, script_length, table=None):
+        """
+        Decompresses every text block using a byte-indexed decode table.
 
-        with open(rom_file, "rb") as f:
-            rom_data = f.read()
+        The compressed stream is made of 16-bit little endian words read MSB first,
+        so each word is consumed as its high byte followed by its low byte. Every
+        byte is resolved with a single lookup in the huffman_table, which returns
+        all the whole symbols completed by those 8 bits and the tree node to resume from.
 
-        tree_base = tree_start + 2
-        results = []
-
-        for blk in range(len(ptr_start)):
-            pos = ptr_start[blk]
-            length = script_length[blk]
-
-            curr_node = get_ushort(rom_data, tree_start)
-            flags_addr = pos
-            flags_mask = 0
-            node_flags = 0
-            symbols_count = 0
-
-            output = []
-            current_line = ""
-
-            while symbols_count < length:
-                if (flags_mask >> 1) == 0:
-                    flags_mask = 0x8000
-                    node_flags = get_ushort(rom_data, flags_addr)
-                    flags_addr += 2
-                else:
-                    flags_mask >>= 1
+        Parameters:
+            rom_data (bytes or memoryview): The ROM contents.
+            tbl_dict (compiled_table or dict[bytes, str]): Compiled table, or the mapping from extraction.read_tbl.
+            tree_start (int): Address of the Huffman tree (root word).
+            tree_size (int): Size of the Huffman tree region.
+            ptr_start (list[int]): Start address of each block.
+            script_length (list[int]): Number of symbols of each block.
+            table (huffman_table, optional): Decode table of the tree, built from the ROM if not given.
 
-                right_node = (node_flags & flags_mask) == 0
-                node = get_ushort(rom_data, tree_base + curr_node + (2 if right_node else 0))
+        Returns:
+            list[list[str]]: The decoded lines of each block.
+        """
+        if table is None:
+            table = huffman_table(rom_data[tree_start:tree_start + tree_size])
+        if isinstance(tbl_dict, compiled_table):
+            symbol_text = tbl_dict.symbols
+        else:
+            symbol_text = [tbl_dict.get(bytes([symbol]), f"<{symbol:02X}>") for symbol in range(256)]
 
-                if node == 0:
-                    symbol = rom_data[tree_base + curr_node - 1]
-                    key = bytes([symbol])
-                    val = tbl_dict.get(key)  
+        return [
+            extraction.symbols_to_lines(extraction.decode_symbols(rom_data, table, ptr_start[blk], script_length[blk]), symbol_text)
+            for blk in range(len(ptr_start))
+        ]
 
-                    if 1 <= symbol <= 4:
-                        output.append(current_line)
-                        current_line = ""
-                        piece = val if val is not None else f"<{symbol:02X}>"
-                        current_line += piece
+    def decode_symbols(rom_data, table, addr, length, node=None, chunk=0):
+        """
+        Decodes the symbols of one block.
 
-                    else:
-                        if val is not None:
-                            current_line += val
-                        else:
-                            current_line += f"<{symbol:02X}>"
+        Parameters:
+            rom_data (bytes or memoryview): The ROM contents.
+            table (huffman_table): Decode table of the tree.
+            addr (int): Start address of the block.
+            length (int): Number of symbols to decode.
+            node (int): Tree node to start from (default: the root).
+            chunk (int): Byte of the stream to start from, bytes are read
+                         high byte first so chunk 1 is addr + 0.
 
-                    symbols_count += 1
+        Returns:
+            bytearray: The decoded symbols.
+        """
+        lookup = table.lookup
+        state = table.root if node is None else node
+        output = bytearray()
+
+        addr += (chunk >> 1) << 1
+        if chunk & 1 and length > 0:
+            symbols, state = lookup(state, rom_data[addr])
+            output.extend(symbols)
+            addr += 2
+
+        while len(output) < length:
+            # High byte first, the stream is read from bit 15 down to bit 0
+            symbols, state = lookup(state, rom_data[addr + 1])
+            output.extend(symbols)
+            if len(output) < length:
+                symbols, state = lookup(state, rom_data[addr])
+                output.extend(symbols)
+            addr += 2
+
+        del output[length:]
+        return output
+
+    def symbols_to_lines(symbols, symbol_text):
+        """
+        Converts decoded symbols to script lines. Symbols 01-04 start a new line.
 
-                    curr_node = get_ushort(rom_data, tree_start)
-                    flags_mask <<= 1
-                else:
-                    curr_node = node
+        Parameters:
+            symbols (bytes or bytearray): Decoded symbols of one block.
+            symbol_text (list[str]): Text of every symbol (compiled_table.symbols).
 
-            if current_line:
+        Returns:
+            list[str]: The lines of the block.
+        """
+        output = []
+        current_line = ""
+
+        for symbol in symbols:
+            if 1 <= symbol <= 4:
                 output.append(current_line)
+                current_line = symbol_text[symbol]
+            else:
+                current_line += symbol_text[symbol]
 
-            if output and output[0] == "":
-                output.pop(0)
-            results.append(output)
+        if current_line:
+            output.append(current_line)
+
+        if output and output[0] == "":
+            output.pop(0)
+        return output
+
+    def init_worker(disk=True):
+        """
+        Process pool initializer. Every worker keeps its own shared_cache, so the
+        table and the decode table of a tree are built once per worker instead
+        of being sent with every task.
+        """
+        extraction.worker_cache = shared_cache(disk)
 
-        return results
+    def decompress_task(rom_file, tbl_file, tree_start, tree_size, ptr_start, script_length):
+        """
+        Process pool entry point, opens the ROM in the worker and decompresses a
+        group of blocks with the tables of the worker cache.
+        """
+        if extraction.worker_cache is None:
+            extraction.init_worker()
+        cache = extraction.worker_cache
+        with rom_session(rom_file) as rom:
+            table = cache.decode_table(rom.read(tree_start, tree_size))
+            return extraction.huffman_decompress(rom.data, cache.load_table(tbl_file), tree_start, tree_size,
+                                                 ptr_start, script_length, table)
 
     def write_out_file(file, script_text, pointers_list, lines_length):
         """
@@ -189,19 +858,97 @@ class extraction:
             address_list (list): A list of addresses corresponding to each line in the script.
             lines_length (list): A list of the length of each line in the script.
         """
-        with open(file, "w", encoding='UTF-8') as f:
-            f.write(f";{{{pointers_list:08X}-{(pointers_list+lines_length-1):08X}-{lines_length:08X}}}\n")          
-            i = 0
-            for line in script_text:             
-                f.write(f"@{i+1}\n")                
-                f.write(f";{{{line}}}\n")               
-                f.write(f"{line}\n")
-                f.write("|\n")
-                i += 1
-                
+        # The block is formatted in memory and written at once
+        chunks = [f";{{{pointers_list:08X}-{(pointers_list+lines_length-1):08X}-{lines_length:08X}}}\n"]
+        chunks.extend(f"@{i}\n;{{{line}}}\n{line}\n|\n" for i, line in enumerate(script_text, start=1))
+        with open(file, "w", encoding='UTF-8', buffering=SCRIPT_BUFFER_SIZE) as f:
+            f.write("".join(chunks))
+
+    def write_jsonl(file, blocks, ptr_array, length_array):
+        """
+        Writes every block of a language to one JSON Lines file. Each block is a
+        {"block", "offset", "symbols", "lines"} record followed by one
+        {"block", "line", "text"} record per line.
+
+        Parameters:
+            file (str): The path to the output file.
+            blocks (list[list[str]]): The lines of every block.
+            ptr_array (list[int]): ROM address of every block.
+            length_array (list[int]): Symbol count of every block.
+        """
+        with open(file, "w", encoding="UTF-8", newline="\n", buffering=SCRIPT_BUFFER_SIZE) as f:
+            for i, lines in enumerate(blocks, start=1):
+                records = [json.dumps({"block": i, "offset": f"{ptr_array[i-1]:08X}", "symbols": length_array[i-1],
+                                       "lines": len(lines)}, ensure_ascii=False)]
+                records.extend(json.dumps({"block": i, "line": n, "text": line}, ensure_ascii=False)
+                               for n, line in enumerate(lines, start=1))
+                f.write("\n".join(records) + "\n")
+
+    def po_escape(text):
+        return text.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n").replace("\t", "\\t")
+
+    def write_po(file, blocks, ptr_array, length_array):
+        """
+        Writes every block of a language to one gettext PO file. Each line is an
+        entry with msgctxt "<block>/<line>", the text as msgid and an empty msgstr.
+
+        Parameters:
+            file (str): The path to the output file.
+            blocks (list[list[str]]): The lines of every block.
+            ptr_array (list[int]): ROM address of every block.
+            length_array (list[int]): Symbol count of every block.
+        """
+        with open(file, "w", encoding="UTF-8", newline="\n", buffering=SCRIPT_BUFFER_SIZE) as f:
+            f.write('msgid ""\nmsgstr ""\n"Content-Type: text/plain; charset=UTF-8\\n"\n\n')
+            for i, lines in enumerate(blocks, start=1):
+                entries = []
+                for n, line in enumerate(lines, start=1):
+                    comment = f"#. Script {i}: {ptr_array[i-1]:08X}, {length_array[i-1]} symbols\n" if n == 1 else ""
+                    entries.append(f'{comment}msgctxt "{i}/{n}"\nmsgid "{extraction.po_escape(line)}"\nmsgstr ""\n\n')
+                f.write("".join(entries))
+
 class insertion:
     def __init__(self):
         pass
+    def iter_script(file):
+        """
+        Yields the text lines of a script file one by one, without the comment
+        and marker lines. The file is read in SCRIPT_BUFFER_SIZE chunks.
+
+        Parameters:
+            file (str): The path to the file to read.
+
+        Yields:
+            str: Each text line, without its newline.
+        """
+        with open(file, "r", encoding='UTF-8', buffering=SCRIPT_BUFFER_SIZE) as f:
+            for line in f:
+                if line[:1] not in SCRIPT_SKIP_PREFIXES:
+                    yield line.rstrip('\n')
+
+    def hash_script(file):
+        """
+        Returns the SHA-1 of the text of a script file, the same as hashing the
+        string of read_script, reading the file line by line.
+        """
+        digest = hashlib.sha1()
+        for line in insertion.iter_script(file):
+            digest.update(line.encode("UTF-8"))
+        return digest
+
+    def script_files(base_in_file, count=20):
+        """
+        Returns the <base>_<n>.txt file of every block.
+        """
+        return [f"{base_in_file}_{i}.txt" for i in range(1, count + 1)]
+
+    def script_lines(script, from_files=False):
+        """
+        Returns what encode_text takes for a script: the lines of the file when
+        scripts are given as file paths (from_files), the script itself otherwise.
+        """
+        return insertion.iter_script(script) if from_files and script is not None else script
+
     def read_script(file):
         """
         Reads a file containing the game's text and returns it as a single list (continuous script).
@@ -212,14 +959,118 @@ class insertion:
         Returns:
             text_data (str): A single string containing all text elements merged from the script.
         """
-        with open(file, "r", encoding='UTF-8') as f:
-            lines = [
-                line.rstrip('\n') for line in f.readlines()
-                if not (line.startswith(";") or line.startswith("@") or line.startswith("|") or line.startswith("&"))
-            ]
+        return "".join(insertion.iter_script(file))
+
+    def read_scripts(base_in_file, script_format="txt", count=20, stream=False):
+        """
+        Reads the scripts of a language, from <base>_<n>.txt files or from a
+        single <base>.jsonl/<base>.po file. With stream, .txt scripts are
+        returned as line generators (see iter_script) for encode_text, so no
+        script is kept in memory.
+
+        Returns:
+            list[str]: The script of every block.
+        """
+        if script_format == "txt":
+            if stream:
+                return [insertion.iter_script(file) for file in insertion.script_files(base_in_file, count)]
+            return [insertion.read_script(file) for file in insertion.script_files(base_in_file, count)]
+
+        script_path = f"{base_in_file}.{script_format}"
+        if script_format == "jsonl":
+            blocks = insertion.read_jsonl(script_path)
+        else:
+            blocks = insertion.read_po(script_path)
+        for block in blocks:
+            if not 1 <= block <= count:
+                print(f"[ERROR] {script_path}: script {block} does not exist, the ROM has {count} scripts.")
+                sys.exit(1)
+        return ["".join(text for _, text in sorted(blocks.get(i, {}).items())) for i in range(1, count + 1)]
+
+    def read_jsonl(file):
+        """
+        Reads a JSON Lines script file written by extraction.write_jsonl. Only
+        the line records are used.
+
+        Returns:
+            dict: {block: {line: text}}
+        """
+        blocks = {}
+        with open(file, "r", encoding="UTF-8", buffering=SCRIPT_BUFFER_SIZE) as f:
+            for line_number, record in enumerate(f, start=1):
+                if not record.strip():
+                    continue
+                try:
+                    record = json.loads(record)
+                    if "line" in record:
+                        blocks.setdefault(int(record["block"]), {})[int(record["line"])] = record["text"]
+                    else:
+                        blocks.setdefault(int(record["block"]), {})
+                except (ValueError, KeyError, TypeError):
+                    print(f"[ERROR] {file}, line {line_number}: invalid record.")
+                    sys.exit(1)
+        return blocks
+
+    def po_unescape(text):
+        output = []
+        idx = 0
+        while idx < len(text):
+            char = text[idx]
+            if char == "\\" and idx + 1 < len(text):
+                idx += 1
+                char = {"n": "\n", "t": "\t", "r": "\r"}.get(text[idx], text[idx])
+            output.append(char)
+            idx += 1
+        return "".join(output)
+
+    def read_po(file):
+        """
+        Reads a gettext PO script file written by extraction.write_po. The
+        msgstr of an entry is used when it's translated, the msgid otherwise.
 
-        script = "".join(lines)
-        return script
+        Returns:
+            dict: {block: {line: text}}
+        """
+        blocks = {}
+        entry = {}
+        key = None
+
+        def add_entry(line_number):
+            context = entry.get("msgctxt")
+            if context is None:
+                # Header entry
+                return
+            try:
+                block, line = (int(value) for value in context.split("/"))
+            except ValueError:
+                print(f"[ERROR] {file}, line {line_number}: invalid msgctxt \"{context}\".")
+                sys.exit(1)
+            blocks.setdefault(block, {})[line] = entry.get("msgstr") or entry.get("msgid", "")
+
+        with open(file, "r", encoding="UTF-8", buffering=SCRIPT_BUFFER_SIZE) as f:
+            line_number = 0
+            for line_number, line in enumerate(f, start=1):
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                if line.startswith('"'):
+                    if key is None:
+                        print(f"[ERROR] {file}, line {line_number}: string outside of an entry.")
+                        sys.exit(1)
+                    entry[key] += insertion.po_unescape(line[1:-1])
+                    continue
+                keyword, _, value = line.partition(" ")
+                if keyword not in ("msgctxt", "msgid", "msgstr") or not value.startswith('"'):
+                    print(f"[ERROR] {file}, line {line_number}: unknown keyword \"{keyword}\".")
+                    sys.exit(1)
+                if keyword in entry or (keyword != "msgstr" and "msgstr" in entry):
+                    add_entry(line_number)
+                    entry = {}
+                key = keyword
+                entry[key] = insertion.po_unescape(value.strip()[1:-1])
+            if entry:
+                add_entry(line_number)
+        return blocks
     
     def read_tbl(tbl_file):
         """
@@ -233,90 +1084,151 @@ class insertion:
                 - char_table (dict): A dictionary where keys are bytes sequences and values are strings (characters or sequences).
                 - chars_lengths (set): Set array with chain char lengths.
         """
-        char_table = {}
-        chars_lengths = set()
+        table = compiled_table.load(tbl_file)
+        return table.encode_map, table.chars_lengths
 
-        with open(tbl_file, "r", encoding="UTF-8") as f:
-            for line in f:
-                if not line or line.startswith(";") or line.startswith("/"):
-                    continue
-                if "=" in line:
-                    hex_value, chars = line.split("=", 1)
-                    chars = chars.strip('\n')
-                    try:
-                        if len(hex_value) % 2 != 0:
-                            print(f"Warning: '{hex_value}' is invalid! Skipped.")
-                            continue
-                        byte_key = bytes.fromhex(hex_value)
-                        char_table[chars] = byte_key
-                        chars_lengths.add(len(chars))
-                    except ValueError:
-                        print(f"Warning: '{hex_value}' is invalid! Skipped.")
-                        continue        
-        chars_lengths = sorted([l for l in chars_lengths if l > 0], reverse=True)
-        
-        return char_table, chars_lengths
+    def build_trie(char_table):
+        """
+        Compiles the inverted .tbl mapping into a character trie.
+
+        Each node is a dict {char -> child node}. The empty string key holds the
+        bytes of the table entry that ends at that node.
+
+        Parameters:
+            char_table (dict): Dictionary {str -> bytes} from the inverted .tbl.
 
-    def encode_text(blocks, char_table, max_char_len):
+        Returns:
+            dict: The root node of the trie.
+        """
+        trie = {}
+        for chars, byte_key in char_table.items():
+            if not chars:
+                continue
+            node = trie
+            for char in chars:
+                node = node.setdefault(char, {})
+            node[""] = byte_key
+        return trie
+
+    def trie_depth(trie):
+        """
+        Returns the length of the longest table entry of a character trie.
         """
-        Encodes a list of text blocks into bytearrays using a character table (supports multibyte mappings).
-        Recognizes <XX> sequences as raw byte values.
+        depth = 0
+        level = [trie]
+        while level:
+            level = [child for node in level for char, child in node.items() if char]
+            if level:
+                depth += 1
+        return depth
+
+    def encode_text(blocks, trie, start=1):
+        """
+        Encodes a list of text blocks into bytearrays using a character trie (supports multibyte mappings).
+        Recognizes <XX> sequences as raw byte values, the longest table entry wins otherwise.
         If an unmapped character is found, the process stops with an error.
 
+        A block can also be an iterable of lines (see insertion.iter_script), the
+        lines are encoded as they are read, as if they were joined: a table entry
+        or <XX> sequence can continue on the next line.
+
         Parameters:
-            blocks (list of str): List of text blocks to encode.
-            char_table (dict): Dictionary {str -> bytes} from the inverted .tbl.
-            max_char_len (int): Maximum length for multibyte sequences (from .tbl).
+            blocks (list of str): List of text blocks to encode. None entries are skipped and stay None.
+            trie (dict): Character trie from insertion.build_trie.
+            start (int): Script number of the first block, used for error reporting.
 
         Returns:
             list of bytearray: A list where each element is a bytearray representing an encoded block.
         """
-        hex_pattern = re.compile(r'<([0-9A-Fa-f]{2})>')
+        hex_digits = frozenset("0123456789ABCDEFabcdef")
         data_list = []
-
-        for block_index, block in enumerate(blocks, start=1):
+        # Characters needed after a position to decide what is encoded there
+        lookahead = None
+
+        for block_index, block in enumerate(blocks, start=start):
+            if block is None:
+                data_list.append(None)
+                continue
+            if isinstance(block, str):
+                chunks = (block,)
+                keep = 0
+            else:
+                chunks = block
+                if lookahead is None:
+                    lookahead = max(4, insertion.trie_depth(trie))
+                keep = lookahead
             block_data = bytearray()
+            # Position of text[0] in the block, for error reporting
+            offset = 0
+            text = ""
             idx = 0
-
-            while idx < len(block):
-                hex_match = hex_pattern.match(block, idx)
-                if hex_match:
-                    byte_val = int(hex_match.group(1), 16)
-                    block_data.append(byte_val)
-                    idx += 4
+            chunk_iter = iter(chunks)
+            final = False
+
+            while not final:
+                chunk = next(chunk_iter, None)
+                if chunk is None:
+                    final = True
+                    chunk = ""
+                elif not chunk:
                     continue
-
-                match = None
-                match_len = 0
-
-                for l in max_char_len:
-                    if idx + l <= len(block):
-                        chunk = block[idx:idx + l]
-                        if chunk in char_table:
-                            match = char_table[chunk]
-                            match_len = l
+                # Carry the characters that couldn't be encoded yet to the next chunk
+                offset += idx
+                text = text[idx:] + chunk if idx < len(text) else chunk
+                block_len = len(text)
+                stop = block_len if final else block_len - keep
+                idx = 0
+
+                while idx < stop:
+                    char = text[idx]
+                    if (char == "<" and idx + 4 <= block_len and text[idx + 3] == ">"
+                            and text[idx + 1] in hex_digits and text[idx + 2] in hex_digits):
+                        block_data.append(int(text[idx + 1:idx + 3], 16))
+                        idx += 4
+                        continue
+
+                    match = None
+                    match_len = 0
+
+                    node = trie.get(char)
+                    end = idx + 1
+                    while node is not None:
+                        value = node.get("")
+                        if value is not None:
+                            match = value
+                            match_len = end - idx
+                        if end == block_len:
                             break
+                        node = node.get(text[end])
+                        end += 1
 
-                if match:
-                    block_data.extend(match)
-                    idx += match_len
-                else:
-                    problem_char = block[idx:idx + 1]
-                    print(f"\n[ERROR] Unmapped character found at script {block_index}, position {idx}: '{problem_char}'")
-                    print("Please check your .tbl file or input text.")
-                    sys.exit(1)
+                    if match:
+                        block_data.extend(match)
+                        idx += match_len
+                    else:
+                        problem_char = text[idx:idx + 1]
+                        print(f"\n[ERROR] Unmapped character found at script {block_index}, position {offset + idx}: '{problem_char}'")
+                        print("Please check your .tbl file or input text.")
+                        sys.exit(1)
 
             data_list.append(block_data)
 
         return data_list
 
-    def huffman_compress(encoded_blocks, rom_file, tree_start, tree_size, base):
+    def build_symbol_lut(rom, tree_start):
+        """
+        Walks the ROM Huffman tree and builds the symbol lookup table used by the compressor.
+
+        Parameters:
+            rom (bytes or memoryview): The ROM contents.
+            tree_start (int): Address of the Huffman tree (root word).
+
+        Returns:
+            dict[int, tuple]: Symbol -> (code length in bits, code value).
+        """
         def get_ushort(data, index):
             return data[index] | (data[index + 1] << 8)
 
-        with open(rom_file, "rb") as f:
-            rom = f.read()
-
         tree_base = tree_start + 2
         root_node = get_ushort(rom, tree_start)
 
@@ -360,75 +1272,537 @@ class insertion:
                 Code <<= 1
                 Depth += 1
 
-        compressed_data = bytearray()
-        symbol_count = []
-        block_offsets = [base]
+        return SymbolLUT
 
-        for block_idx, block in enumerate(encoded_blocks, start=1):
-            CurrWord = 0
-            CurrBits = 0
-            symbols_decoded = 0
-            block_bytes = bytearray()
+    def compress_block(block, SymbolLUT, block_idx):
+        """
+        Packs the Huffman codes of one encoded block into 16-bit little endian words (MSB first).
 
-            for symbol in block:
-                if symbol not in SymbolLUT:
-                    print(f"[ERROR] Script: {block_idx}, encounter Symbol: {symbol:02X}, not found in huffman tree.")
-                    sys.exit(1)
+        Large blocks use the NumPy packer when NumPy is installed, the output is
+        identical to compress_block_python.
 
-                Bits, CodeVal = SymbolLUT[symbol]
-                if CurrBits + Bits <= 16:
-                    CurrWord = (CurrWord << Bits) & 0xFFFF
-                    CurrWord |= (CodeVal & ((1 << Bits) - 1))
-                    CurrBits += Bits
-                    
-                else:
-                    SplitBits = 16 - CurrBits
-                    SplitCode = (CodeVal >> (Bits - SplitBits)) & ((1 << SplitBits) - 1)
+        Parameters:
+            block (bytearray): Encoded block from encode_text.
+            SymbolLUT (dict): Symbol lookup table from build_symbol_lut.
+            block_idx (int): Script number, used for error reporting.
 
-                    CurrWord = (CurrWord << SplitBits) & 0xFFFF
-                    CurrWord |= SplitCode
+        Returns:
+            tuple: (block_bytes, symbols)
+                block_bytes (bytearray): The compressed block.
+                symbols (int): Number of symbols packed.
+        """
+        if np is not None and len(block) >= NUMPY_MIN_SYMBOLS:
+            return insertion.compress_block_numpy(block, SymbolLUT, block_idx)
+        return insertion.compress_block_python(block, SymbolLUT, block_idx)
 
-                    block_bytes.append(CurrWord & 0xFF)
-                    block_bytes.append((CurrWord >> 8) & 0xFF)
+    def compress_block_numpy(block, SymbolLUT, block_idx):
+        """
+        Vectorized version of compress_block_python.
 
-                    CurrBits = Bits - SplitBits
-                    # CurrWord = Code & ((1 << CurrBits) - 1);
-                    CurrWord = CodeVal & ((1 << CurrBits) - 1)
-                symbols_decoded += 1
+        Code values and lengths are gathered from 256-entry arrays built from the
+        SymbolLUT, every code is expanded to its bits and the stream is packed at
+        once. np.packbits is MSB first, so each pair of bytes is swapped to store
+        the 16-bit words little endian.
 
-            if CurrBits != 0:
-                CurrWord = (CurrWord << (16 - CurrBits)) & 0xFFFF
-                block_bytes.append(CurrWord & 0xFF)
-                block_bytes.append((CurrWord >> 8) & 0xFF)
+        Parameters:
+            block (bytearray): Encoded block from encode_text.
+            SymbolLUT (dict): Symbol lookup table from build_symbol_lut.
+            block_idx (int): Script number, used for error reporting.
+
+        Returns:
+            tuple: (block_bytes, symbols)
+        """
+        code_lengths = np.zeros(256, dtype=np.int64)
+        code_values = np.zeros(256, dtype=np.int64)
+        in_tree = np.zeros(256, dtype=bool)
+        for symbol, (Bits, CodeVal) in SymbolLUT.items():
+            code_lengths[symbol] = Bits
+            code_values[symbol] = CodeVal
+            in_tree[symbol] = True
+
+        symbols = np.frombuffer(bytes(block), dtype=np.uint8)
+        missing = ~in_tree[symbols]
+        if missing.any():
+            symbol = int(symbols[np.argmax(missing)])
+            print(f"[ERROR] Script: {block_idx}, encounter Symbol: {symbol:02X}, not found in huffman tree.")
+            sys.exit(1)
 
-            compressed_data.extend(block_bytes)
-            symbol_count.append(symbols_decoded)
-            symbols_decoded = 0
-            block_offsets.append(block_offsets[-1] + len(block_bytes))
+        lengths = code_lengths[symbols]
+        total_bits = int(lengths.sum())
+        if total_bits == 0:
+            return bytearray(), len(symbols)
 
-            # DEBBUG(IGNORE)
-##            if block_idx == 1:
-##                print(f"Block {block_idx} len={len(block_bytes)} bytes")
-##                print(block_bytes.hex(" ").upper())
+        # Left-align every code in a big endian 16-bit word, unpack it to 16 bits and
+        # keep the first <length> bits of each row, row order is the stream order.
+        aligned = ((code_values[symbols] << (16 - lengths)) & 0xFFFF).astype(">u2")
+        code_bits = np.unpackbits(aligned.view(np.uint8)).reshape(-1, 16)
+        bits = np.zeros(-(-total_bits // 16) * 16, dtype=np.uint8)
+        bits[:total_bits] = code_bits[np.arange(16) < lengths[:, None]]
 
-        block_offsets.pop()
-        return compressed_data, len(compressed_data), symbol_count, block_offsets
+        words = np.packbits(bits).reshape(-1, 2)[:, ::-1]
+        return bytearray(words.tobytes()), len(symbols)
 
-    def create_4_bytes_pointers(script_size, script_offset):
+    def compress_block_python(block, SymbolLUT, block_idx):
         """
-        Creates a bytearray of 4-byte pointers combining size and offset values in little endian.
+        Packs the Huffman codes of one encoded block into 16-bit little endian words (MSB first).
 
         Parameters:
-            script_size (list[int]): List of block sizes (2-byte values).
-            script_offset (list[int]): List of block offsets (2-byte values).
+            block (bytearray): Encoded block from encode_text.
+            SymbolLUT (dict): Symbol lookup table from build_symbol_lut.
+            block_idx (int): Script number, used for error reporting.
 
         Returns:
-            bytearray: Concatenated 4-byte pointers (size + offset), both in little endian.
+            tuple: (block_bytes, symbols)
+                block_bytes (bytearray): The compressed block.
+                symbols (int): Number of symbols packed.
         """
-        script_size = reverse_list(script_size)
-        script_offset = reverse_list(script_offset)
+        CurrWord = 0
+        CurrBits = 0
+        symbols_decoded = 0
+        block_bytes = bytearray()
+
+        for symbol in block:
+            if symbol not in SymbolLUT:
+                print(f"[ERROR] Script: {block_idx}, encounter Symbol: {symbol:02X}, not found in huffman tree.")
+                sys.exit(1)
+
+            Bits, CodeVal = SymbolLUT[symbol]
+            if CurrBits + Bits <= 16:
+                CurrWord = (CurrWord << Bits) & 0xFFFF
+                CurrWord |= (CodeVal & ((1 << Bits) - 1))
+                CurrBits += Bits
 
-        pointers = bytearray()
+            else:
+                SplitBits = 16 - CurrBits
+                SplitCode = (CodeVal >> (Bits - SplitBits)) & ((1 << SplitBits) - 1)
+
+                CurrWord = (CurrWord << SplitBits) & 0xFFFF
+                CurrWord |= SplitCode
+
+                block_bytes.append(CurrWord & 0xFF)
+                block_bytes.append((CurrWord >> 8) & 0xFF)
+
+                CurrBits = Bits - SplitBits
+                # CurrWord = Code & ((1 << CurrBits) - 1);
+                CurrWord = CodeVal & ((1 << CurrBits) - 1)
+            symbols_decoded += 1
+
+        if CurrBits != 0:
+            CurrWord = (CurrWord << (16 - CurrBits)) & 0xFFFF
+            block_bytes.append(CurrWord & 0xFF)
+            block_bytes.append((CurrWord >> 8) & 0xFF)
+
+        return block_bytes, symbols_decoded
+
+    def limited_code_lengths(frequencies, max_bits):
+        """
+        Computes optimal Huffman code lengths no longer than max_bits (package-merge).
+
+        Parameters:
+            frequencies (dict[int, int]): Symbol -> number of occurrences.
+            max_bits (int): Maximum code length.
+
+        Returns:
+            dict[int, int]: Symbol -> code length in bits.
+        """
+        symbols = sorted(frequencies, key=lambda symbol: (frequencies[symbol], symbol))
+        if len(symbols) == 1:
+            return {symbols[0]: 1}
+        if len(symbols) > (1 << max_bits):
+            raise ValueError(f"{len(symbols)} symbols do not fit in {max_bits}-bit codes.")
+
+        leaves = [(frequencies[symbol], (symbol,)) for symbol in symbols]
+        packages = list(leaves)
+        for _ in range(max_bits - 1):
+            merged = [
+                (packages[i][0] + packages[i + 1][0], packages[i][1] + packages[i + 1][1])
+                for i in range(0, len(packages) - 1, 2)
+            ]
+            packages = sorted(leaves + merged, key=lambda package: package[0])
+
+        code_lengths = collections.Counter()
+        for _, package_symbols in packages[:2 * len(symbols) - 2]:
+            code_lengths.update(package_symbols)
+        return dict(code_lengths)
+
+    def build_tree(code_lengths):
+        """
+        Builds a tree region in the ROM node format from code lengths.
+
+        Codes are assigned canonically. Every node takes 5 bytes: the symbol byte,
+        then the children for bit 1 and bit 0, a leaf has both children at 0.
+        The region starts with the root node offset.
+
+        Parameters:
+            code_lengths (dict[int, int]): Symbol -> code length in bits.
+
+        Returns:
+            bytearray: The tree region (root word + nodes).
+        """
+        tree_data = bytearray(2)
+
+        def new_node(symbol=0):
+            node = len(tree_data) - 2 + 1
+            tree_data.extend(bytes([symbol]) + bytes(4))
+            return node
+
+        def set_child(node, bit, child):
+            index = 2 + node + (0 if bit else 2)
+            tree_data[index:index + 2] = child.to_bytes(2, "little")
+
+        def get_child(node, bit):
+            index = 2 + node + (0 if bit else 2)
+            return tree_data[index] | (tree_data[index + 1] << 8)
+
+        root = new_node()
+        tree_data[0:2] = root.to_bytes(2, "little")
+
+        code = 0
+        prev_length = 0
+        for symbol in sorted(code_lengths, key=lambda symbol: (code_lengths[symbol], symbol)):
+            length = code_lengths[symbol]
+            code <<= length - prev_length
+            prev_length = length
+
+            node = root
+            for depth in range(length - 1, -1, -1):
+                bit = (code >> depth) & 1
+                child = get_child(node, bit)
+                if child == 0:
+                    child = new_node(symbol if depth == 0 else 0)
+                    set_child(node, bit, child)
+                node = child
+            code += 1
+
+        return tree_data
+
+    def rebuild_tree(encoded_blocks, tree_size, max_bits=16):
+        """
+        Builds a new Huffman tree from the symbol frequencies of the encoded scripts.
+
+        Parameters:
+            encoded_blocks (list[bytearray]): Encoded blocks from encode_text.
+            tree_size (int): Size of the tree region in the ROM.
+            max_bits (int): Maximum code length (the compressor packs up to 16 bits).
+
+        Returns:
+            bytearray: The tree region, padded with 0x00 up to tree_size.
+        """
+        frequencies = collections.Counter()
+        for block in encoded_blocks:
+            frequencies.update(block)
+        # A tree needs at least two leaves, a single leaf at the root never consumes a bit
+        for symbol in (0x00, 0x20):
+            if len(frequencies) >= 2:
+                break
+            frequencies.setdefault(symbol, 0)
+
+        max_symbols = (tree_size - 2 + 5) // 10
+        if len(frequencies) > max_symbols:
+            print(f"\nERROR: the scripts use {len(frequencies)} different symbols, the tree region only fits {max_symbols}.")
+            sys.exit(1)
+
+        tree_data = insertion.build_tree(insertion.limited_code_lengths(frequencies, max_bits))
+        return tree_data + bytes(tree_size - len(tree_data))
+
+    def estimate_size(encoded_blocks, SymbolLUT):
+        """
+        Computes the compressed size of every block without packing any bit.
+
+        The size of a block is the sum of the code lengths of its symbols, rounded
+        up to whole 16-bit words, which is exactly what compress_block produces.
+
+        Parameters:
+            encoded_blocks (list[bytearray]): Encoded blocks from encode_text.
+            SymbolLUT (dict): Symbol lookup table from build_symbol_lut.
+
+        Returns:
+            list[tuple]: (compressed size in bytes, symbols) for every block.
+        """
+        sizes = []
+        for block_idx, block in enumerate(encoded_blocks, start=1):
+            total_bits = 0
+            for symbol, count in collections.Counter(block).items():
+                if symbol not in SymbolLUT:
+                    print(f"[ERROR] Script: {block_idx}, encounter Symbol: {symbol:02X}, not found in huffman tree.")
+                    sys.exit(1)
+                total_bits += SymbolLUT[symbol][0] * count
+            sizes.append((-(-total_bits // 16) * 2, len(block)))
+        return sizes
+
+    def size_report(encoded_blocks, SymbolLUT, text_size, ptr_size, dedup=False):
+        """
+        Reports the space the encoded blocks would take once inserted.
+
+        Parameters:
+            encoded_blocks (list[bytearray]): Encoded blocks from encode_text.
+            SymbolLUT (dict): Symbol lookup table from build_symbol_lut.
+            text_size (int): Size available for the compressed text.
+            ptr_size (int): Size of the pointer table.
+            dedup (bool): Blocks repeated in other blocks share their storage (insert --dedup),
+                          the blocks are packed to find them.
+
+        Returns:
+            dict: {
+                "blocks": [{"bytes": int, "symbols": int}, ...],
+                "text_bytes": int, "text_size": int, "text_free": int, "shared_bytes": int,
+                "ptr_bytes": int, "ptr_size": int, "ptr_free": int,
+                "fits": bool,
+            }
+        """
+        sizes = insertion.estimate_size(encoded_blocks, SymbolLUT)
+        text_bytes = sum(size for size, _ in sizes)
+        shared_bytes = 0
+        if dedup:
+            compressed_blocks = [insertion.compress_block(block, SymbolLUT, block_idx)
+                                 for block_idx, block in enumerate(encoded_blocks, start=1)]
+            shared_bytes = text_bytes - insertion.pack_blocks(compressed_blocks, 0, True)[1]
+            text_bytes -= shared_bytes
+        ptr_bytes = 4 * len(sizes)
+        return {
+            "blocks": [{"bytes": size, "symbols": symbols} for size, symbols in sizes],
+            "text_bytes": text_bytes,
+            "shared_bytes": shared_bytes,
+            "text_size": text_size,
+            "text_free": text_size - text_bytes,
+            "ptr_bytes": ptr_bytes,
+            "ptr_size": ptr_size,
+            "ptr_free": ptr_size - ptr_bytes,
+            "fits": text_bytes <= text_size and ptr_bytes <= ptr_size,
+        }
+
+    def pack_blocks(compressed_blocks, base, dedup=False):
+        """
+        Concatenates compressed blocks and computes their offsets.
+
+        Parameters:
+            compressed_blocks (list[tuple]): (block_bytes, symbols) for every block.
+            base (int): Offset of the first block.
+            dedup (bool): Blocks found in other blocks (see shared_blocks) are not
+                          stored again, their pointer goes to the other copy.
+
+        Returns:
+            tuple: (compressed_data, compressed_size, symbol_count, block_offsets)
+        """
+        compressed_data = bytearray()
+        symbol_count = []
+        block_offsets = []
+        shared = insertion.shared_blocks([block_bytes for block_bytes, _ in compressed_blocks]) if dedup else set()
+
+        for block_idx, (block_bytes, symbols) in enumerate(compressed_blocks):
+            block_offsets.append(None if block_idx in shared else base + len(compressed_data))
+            if block_idx not in shared:
+                compressed_data.extend(block_bytes)
+            symbol_count.append(symbols)
+        for block_idx in shared:
+            block_offsets[block_idx] = base + compressed_data.find(compressed_blocks[block_idx][0])
+
+        return compressed_data, len(compressed_data), symbol_count, block_offsets
+
+    def shared_blocks(blocks):
+        """
+        Finds the compressed blocks that don't need their own copy: repeats of
+        an earlier identical block (found by hash) and blocks whose bytes appear
+        inside a longer block, like the tail of a block ending with the same text.
+        The decoder stops after the symbol count of the pointer, so any copy of
+        the bytes decodes the same.
+
+        Parameters:
+            blocks (list[bytes]): Compressed blocks.
+
+        Returns:
+            set[int]: Indexes (0-based) of the blocks to share.
+        """
+        shared = set()
+        seen = set()
+        for block_idx, block_bytes in enumerate(blocks):
+            if not block_bytes:
+                continue
+            digest = hashlib.sha1(block_bytes).digest()
+            if digest in seen:
+                shared.add(block_idx)
+            seen.add(digest)
+
+        for block_idx, block_bytes in enumerate(blocks):
+            if block_idx in shared or not block_bytes:
+                continue
+            if any(len(other) > len(block_bytes) and block_bytes in other for other in blocks):
+                shared.add(block_idx)
+        return shared
+
+    def huffman_compress(encoded_blocks, rom, tree_start, tree_size, base):
+        """
+        Compresses every encoded block with the Huffman tree stored in the ROM.
+
+        Parameters:
+            encoded_blocks (list[bytearray]): Encoded blocks from encode_text.
+            rom (bytes or memoryview): The ROM contents.
+            tree_start (int): Address of the Huffman tree (root word).
+            tree_size (int): Size of the Huffman tree region.
+            base (int): Offset of the first block.
+
+        Returns:
+            tuple: (compressed_data, compressed_size, symbol_count, block_offsets)
+        """
+        SymbolLUT = insertion.build_symbol_lut(rom, tree_start)
+        compressed_blocks = [
+            insertion.compress_block(block, SymbolLUT, block_idx)
+            for block_idx, block in enumerate(encoded_blocks, start=1)
+        ]
+        return insertion.pack_blocks(compressed_blocks, base)
+
+    def encode_task(scripts, trie, from_files=False):
+        """
+        Process pool entry point, encodes a group of scripts.
+
+        Parameters:
+            scripts (list): Every script of the language, None for the scripts handled elsewhere.
+                            Keeping the full list keeps the script numbers of the error messages.
+            trie (dict): Character trie from insertion.build_trie.
+            from_files (bool): Scripts are .txt file paths, streamed line by line.
+
+        Returns:
+            dict[int, bytearray]: Script number -> encoded block.
+        """
+        encoded_scripts = insertion.encode_text([insertion.script_lines(script, from_files) for script in scripts], trie)
+        return {
+            block_idx: block
+            for block_idx, block in enumerate(encoded_scripts, start=1)
+            if block is not None
+        }
+
+    def compress_task(encoded_blocks, SymbolLUT):
+        """
+        Process pool entry point, compresses a group of encoded blocks.
+
+        Parameters:
+            encoded_blocks (dict[int, bytearray]): Script number -> encoded block.
+            SymbolLUT (dict): Symbol lookup table from build_symbol_lut.
+
+        Returns:
+            dict[int, tuple]: Script number -> (block_bytes, symbols).
+        """
+        return {
+            block_idx: insertion.compress_block(block, SymbolLUT, block_idx)
+            for block_idx, block in encoded_blocks.items()
+        }
+
+    def verify_task(lang, table, text_data, ptr_table, blocks, trie, from_files=False):
+        """
+        Process pool entry point, decodes a group of blocks from the new text and
+        pointer table and compares them with the encoded scripts.
+
+        Parameters:
+            lang (str): Language, used for error reporting.
+            table (huffman_table): Decode table of the tree the text was compressed with.
+            text_data (bytes): The new text region (offsets start at 0).
+            ptr_table (bytes): The new pointer table, as written to the ROM.
+            blocks (dict[int, bytearray or str]): Script number -> encoded block,
+                                                  scripts given as text are encoded first.
+            trie (dict): Character trie, used for the scripts given as text.
+            from_files (bool): Scripts are given as .txt file paths instead of text.
+
+        Returns:
+            list[str]: One message per mismatch, empty when every block matches.
+        """
+        offsets, lengths = extraction.read_ptr_table(ptr_table, 0)
+        offsets = reverse_list(offsets)
+        lengths = reverse_list(lengths)
+        errors = []
+        # The last symbol of a block is only complete once the decoder reads the
+        # next bit, a block ending on a word boundary reads the word after it.
+        # Its value doesn't change the symbols, so the data is padded with zeros.
+        text_data = bytes(text_data) + bytes(2)
+
+        for block_idx, block in blocks.items():
+            if isinstance(block, str):
+                block = insertion.encode_text([insertion.script_lines(block, from_files)], trie, block_idx)[0]
+            if block_idx > len(lengths):
+                errors.append(f"[{lang}] script {block_idx} has no pointer.")
+                continue
+            offset = offsets[block_idx - 1]
+            length = lengths[block_idx - 1]
+            if length != len(block):
+                errors.append(f"[{lang}] script {block_idx} has {len(block)} symbols, its pointer says {length}.")
+                continue
+            try:
+                decoded = extraction.decode_symbols(text_data, table, offset, length)
+            except IndexError:
+                errors.append(f"[{lang}] script {block_idx} runs past the end of the text.")
+                continue
+            if decoded != block:
+                position = next(i for i, (a, b) in enumerate(zip(decoded, block)) if a != b)
+                errors.append(f"[{lang}] script {block_idx} decodes to {decoded[position]:02X} at symbol {position}, "
+                              f"{block[position]:02X} was encoded.")
+        return errors
+
+    def read_manifest(manifest_file, table_hash, tree_hash):
+        """
+        Loads the incremental insert manifest stored next to the scripts.
+
+        The manifest is discarded when the .tbl file or the ROM Huffman tree changed
+        since it was written, because every cached bitstream would be stale.
+
+        Parameters:
+            manifest_file (str): The path to the manifest file.
+            table_hash (str): SHA-1 of the .tbl file contents.
+            tree_hash (str): SHA-1 of the ROM tree region.
+
+        Returns:
+            dict[int, tuple]: Script number -> (script_hash, block_bytes, symbols).
+        """
+        if not os.path.exists(manifest_file):
+            return {}
+        try:
+            with open(manifest_file, "r", encoding="UTF-8") as f:
+                manifest = json.load(f)
+        except (ValueError, OSError):
+            print(f"Warning: '{manifest_file}' is invalid! Ignored.")
+            return {}
+        if manifest.get("version") != MANIFEST_VERSION or manifest.get("table") != table_hash or manifest.get("tree") != tree_hash:
+            return {}
+        return {
+            int(block_idx): (entry["hash"], bytearray.fromhex(entry["data"]), entry["symbols"])
+            for block_idx, entry in manifest.get("blocks", {}).items()
+        }
+
+    def write_manifest(manifest_file, table_hash, tree_hash, blocks):
+        """
+        Writes the incremental insert manifest.
+
+        Parameters:
+            manifest_file (str): The path to the manifest file.
+            table_hash (str): SHA-1 of the .tbl file contents.
+            tree_hash (str): SHA-1 of the ROM tree region.
+            blocks (dict[int, tuple]): Script number -> (script_hash, block_bytes, symbols).
+        """
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "table": table_hash,
+            "tree": tree_hash,
+            "blocks": {
+                str(block_idx): {"hash": script_hash, "symbols": symbols, "data": bytes(block_bytes).hex()}
+                for block_idx, (script_hash, block_bytes, symbols) in sorted(blocks.items())
+            },
+        }
+        with open(manifest_file, "w", encoding="UTF-8") as f:
+            json.dump(manifest, f, indent=1)
+
+    def create_4_bytes_pointers(script_size, script_offset):
+        """
+        Creates a bytearray of 4-byte pointers combining size and offset values in little endian.
+
+        Parameters:
+            script_size (list[int]): List of block sizes (2-byte values).
+            script_offset (list[int]): List of block offsets (2-byte values).
+
+        Returns:
+            bytearray: Concatenated 4-byte pointers (size + offset), both in little endian.
+        """
+        script_size = reverse_list(script_size)
+        script_offset = reverse_list(script_offset)
+
+        pointers = bytearray()
 
         for size, offset in zip(script_size, script_offset):
             size_le = size.to_bytes(2, "little")
@@ -437,12 +1811,12 @@ class insertion:
 
         return pointers, len(pointers)
         
-    def write_rom(rom_file, start_offset, original_size, data, fill_free_space, fill_free_space_byte):
+    def write_rom(rom, start_offset, original_size, data, fill_free_space, fill_free_space_byte):
         """
         Writes data to the ROM at the specified offset, filling any free space if requested.
         
         Parameters:
-            rom_file (str): The path to the ROM file.
+            rom (rom_session): The ROM opened as writable, data is written on flush.
             start_offset (int): The offset in the ROM file where data should be written.
             original_size (int): The original size of the data to ensure there is enough space for the write operation.
             data (bytes or bytearray): The data to write to the ROM.
@@ -457,39 +1831,1973 @@ class insertion:
             filled_data = data + bytes([fill_free_space_byte]) * free_space
         else:
             filled_data = data    
-        with open(rom_file, "r+b") as f: 
-            f.seek(start_offset)
-            f.write(filled_data)
+        rom.write(start_offset, filled_data)
         return free_space
  
+class dte_planner:
+    """
+    Plans DTE/MTE table entries (a substring encoded as one symbol) for the
+    symbols the table doesn't use.
+
+    Substrings are counted line by line and ranked by the bits they would save.
+    The best ones are checked by encoding again the lines that contain them,
+    and the one that saves the most takes the free symbol with the shortest
+    code. With a rebuilt tree (insert --rebuild-tree) the symbols the table
+    maps but the scripts never use are free instead (the font has a glyph for
+    them, other bytes may not be drawn at all), their old entry is replaced and
+    the code lengths are computed again for every candidate.
+    """
+    MAX_LENGTH = 8
+    MIN_COUNT = 4
+    CANDIDATES = 24
+
+    def ngram_counts(lines, trie, max_length=MAX_LENGTH, min_count=MIN_COUNT):
+        """
+        Counts the substrings of 2 to max_length characters of the lines.
+
+        Tags (<XX> codes and table entries like <LINE>), characters the table
+        can't encode alone and substrings starting with a comment/marker
+        character of the script files are skipped.
+
+        Returns:
+            collections.Counter: Substring -> occurrences (overlapping), min_count or more.
+        """
+        counts = collections.Counter()
+        for line in lines:
+            for segment in re.split(r"<[^<>]*>", line):
+                # Cut the segment at the characters without a table entry of their own
+                start = 0
+                for end in range(len(segment) + 1):
+                    if end < len(segment) and segment[end] in trie and "" in trie[segment[end]]:
+                        continue
+                    run = segment[start:end]
+                    for size in range(2, max_length + 1):
+                        counts.update(run[idx:idx + size] for idx in range(len(run) - size + 1)
+                                      if run[idx] not in SCRIPT_SKIP_PREFIXES)
+                    start = end + 1
+        return collections.Counter({ngram: count for ngram, count in counts.items() if count >= min_count})
+
+    def free_symbols(SymbolLUT, table, encoded_blocks, rebuild=False):
+        """
+        Returns the symbols that can take a new entry, not used by the scripts
+        (<XX> included) and not a line break: in the tree and not in the table,
+        or with rebuild in the table as a single byte. Symbols with shorter codes
+        come first, in byte order with rebuild.
+        """
+        used = set(range(5))
+        for block in encoded_blocks:
+            used.update(block)
+        if rebuild:
+            mapped = {byte_key[0] for byte_key in table.decode_map if len(byte_key) == 1}
+            return sorted(mapped - used)
+        used.update(symbol for byte_key in table.decode_map for symbol in byte_key)
+        return sorted((symbol for symbol in SymbolLUT if symbol not in used), key=lambda symbol: (SymbolLUT[symbol][0], symbol))
+
+    def code_lengths(frequencies, SymbolLUT=None):
+        """
+        Returns the code length of every symbol: from the ROM tree, or from a
+        tree rebuilt from the frequencies when SymbolLUT is None.
+        """
+        if SymbolLUT is not None:
+            return {symbol: bits for symbol, (bits, _) in SymbolLUT.items()}
+        used = {symbol: count for symbol, count in frequencies.items() if count > 0}
+        return insertion.limited_code_lengths(used, 16) if len(used) > 1 else {symbol: 1 for symbol in used}
+
+    def cost(frequencies, SymbolLUT=None):
+        """
+        Returns the compressed size in bits of the symbol frequencies.
+        """
+        lengths = dte_planner.code_lengths(frequencies, SymbolLUT)
+        return sum(count * lengths[symbol] for symbol, count in frequencies.items() if count > 0)
+
+    def plan(blocks, table, SymbolLUT, free, rebuild=False, max_symbols=None, max_length=MAX_LENGTH,
+             min_count=MIN_COUNT, max_entries=None):
+        """
+        Chooses the new entries greedily, one free symbol at a time.
+
+        Parameters:
+            blocks (list[list[str]]): The lines of every script.
+            table (compiled_table): Current table.
+            SymbolLUT (dict): Symbol lookup table of the ROM tree.
+            free (list[int]): Free symbols from free_symbols, the entries of the table
+                              for them are dropped when they are used.
+            rebuild (bool): Plan for a tree rebuilt from the new frequencies.
+            max_symbols (int): Symbols that fit in the tree region, used with rebuild.
+            max_length (int): Longest substring.
+            min_count (int): Fewest occurrences of a substring.
+            max_entries (int): Most entries, every free symbol by default.
+
+        Returns:
+            tuple: (entries, size_before, size_after)
+                entries (list[tuple]): (symbol, substring, bits saved) in the order they were chosen.
+                size_before, size_after (int): Compressed size of the scripts in bytes.
+        """
+        tree_lut = None if rebuild else SymbolLUT
+        lines = [line for block in blocks for line in block]
+        encode_map = dict(table.encode_map)
+        trie = table.trie
+        line_symbols = insertion.encode_text(lines, trie)
+        frequencies = collections.Counter()
+        for symbols in line_symbols:
+            frequencies.update(symbols)
+        counts = dte_planner.ngram_counts(lines, trie, max_length, min_count)
+        for ngram in encode_map:
+            counts.pop(ngram, None)
+        free = list(free)
+        entries = []
+
+        while free and counts and (max_entries is None or len(entries) < max_entries):
+            symbol = free[0]
+            replaced = {chars: byte_key for chars, byte_key in encode_map.items() if byte_key != bytes([symbol])}
+            current_cost = dte_planner.cost(frequencies, tree_lut)
+            lengths = dte_planner.code_lengths(frequencies, tree_lut)
+            total = sum(frequencies.values())
+
+            # Bits of every character alone, the estimate ignores the entries of several characters
+            char_bits = {char: lengths.get(node[""][0], 16) for char, node in trie.items() if "" in node and len(node[""]) == 1}
+            def estimate(item):
+                ngram, count = item
+                new_bits = SymbolLUT[symbol][0] if not rebuild else max(1, (total // count).bit_length())
+                return count * (sum(char_bits.get(char, 16) for char in ngram) - new_bits)
+            ranked = sorted(counts.items(), key=estimate, reverse=True)[:dte_planner.CANDIDATES]
+
+            best = None
+            for ngram, _ in ranked:
+                affected = [idx for idx, line in enumerate(lines) if ngram in line]
+                new_trie = insertion.build_trie({**replaced, ngram: bytes([symbol])})
+                new_symbols = insertion.encode_text([lines[idx] for idx in affected], new_trie)
+                new_frequencies = collections.Counter(frequencies)
+                for idx, symbols in zip(affected, new_symbols):
+                    new_frequencies.subtract(line_symbols[idx])
+                    new_frequencies.update(symbols)
+                if rebuild and max_symbols is not None and sum(1 for count in new_frequencies.values() if count > 0) > max_symbols:
+                    continue
+                gain = current_cost - dte_planner.cost(new_frequencies, tree_lut)
+                if gain <= 0:
+                    # It never saves anything, don't check it again
+                    del counts[ngram]
+                elif best is None or gain > best[0]:
+                    best = (gain, ngram, new_trie, affected, new_symbols, new_frequencies)
+
+            if best is None:
+                if not any(ngram in counts for ngram, _ in ranked):
+                    continue
+                break
+            gain, ngram, trie, affected, new_symbols, frequencies = best
+            encode_map = {**replaced, ngram: bytes([symbol])}
+            for idx, symbols in zip(affected, new_symbols):
+                line_symbols[idx] = symbols
+            del counts[ngram]
+            free.pop(0)
+            entries.append((symbol, ngram, gain))
+
+        # Exact sizes, blocks are encoded as insert does and rounded to whole words
+        def size(trie, lut):
+            encoded = insertion.encode_text(["".join(block) for block in blocks], trie)
+            if lut is None:
+                block_frequencies = collections.Counter()
+                for block in encoded:
+                    block_frequencies.update(block)
+                lut = {symbol: (bits, 0) for symbol, bits in dte_planner.code_lengths(block_frequencies).items()}
+            return sum(block_size for block_size, _ in insertion.estimate_size(encoded, lut))
+
+        return entries, size(table.trie, tree_lut), size(trie, tree_lut)
+
+    def write_tbl(tbl_file, out_file, entries):
+        """
+        Writes a copy of a .tbl file with the planned entries at the end, the
+        entries they replace are commented out.
+        """
+        replaced = {f"{symbol:02X}" for symbol, _, _ in entries}
+        with open(tbl_file, "r", encoding="UTF-8") as f:
+            text = "".join(";" + line if line.split("=", 1)[0].upper() in replaced else line for line in f)
+        if text and not text.endswith("\n"):
+            text += "\n"
+        text += "; DTE/MTE entries planned by dkc3_texteditor plan\n"
+        text += "".join(f"{symbol:02X}={ngram}\n" for symbol, ngram, _ in entries)
+        with open(out_file, "w", encoding="UTF-8", newline="\n") as f:
+            f.write(text)
+
+class stage_profiler:
+    """
+    Wall time and CPU time of every stage of a run, plus the symbols, bits
+    and bytes of every block, written as a JSON report.
+
+    A disabled profiler only runs the stages, so the runners always use one.
+    CPU time is the time of this process, work done in pool workers only shows
+    in the wall time. With memory, the peak memory of every stage is traced
+    too; tracing slows Python down, so the times of that run are not comparable
+    with a run without it.
+    """
+    def __init__(self, enabled=False, memory=False):
+        self.enabled = enabled
+        self.memory = enabled and memory
+        self.stages = []
+        self.blocks = []
+        self.start_time = time.perf_counter()
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextlib.contextmanager
+    def stage(self, name, lang=None):
+        """
+        Context manager timing one stage.
+        """
+        if not self.enabled:
+            yield
+            return
+        if self.memory:
+            tracemalloc.reset_peak()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            entry = {
+                "stage": name,
+                "lang": lang,
+                "wall_s": time.perf_counter() - wall_start,
+                "cpu_s": time.process_time() - cpu_start,
+            }
+            if self.memory:
+                entry["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+            self.stages.append(entry)
+
+    def block(self, lang, block, symbols, bits, size):
+        """
+        Records the counters of one block. Counters that are not known are None
+        and left out of the entry.
+        """
+        if self.enabled:
+            entry = {"lang": lang, "block": block, "symbols": symbols, "bits": bits, "bytes": size}
+            self.blocks.append({key: value for key, value in entry.items() if value is not None})
+
+    def report(self, command):
+        totals = {}
+        for entry in self.stages:
+            total = totals.setdefault(entry["stage"], {"wall_s": 0.0, "cpu_s": 0.0})
+            total["wall_s"] += entry["wall_s"]
+            total["cpu_s"] += entry["cpu_s"]
+            if self.memory:
+                total["peak_bytes"] = max(total.get("peak_bytes", 0), entry["peak_bytes"])
+        return {
+            "command": command,
+            "memory": self.memory,
+            "total_wall_s": time.perf_counter() - self.start_time,
+            "stages": self.stages,
+            "totals": totals,
+            "blocks": self.blocks,
+        }
+
+    def write(self, report_file, command):
+        with open(report_file, "w", encoding="UTF-8") as f:
+            json.dump(self.report(command), f, indent=1)
+        print(f"Profile written to {report_file}")
+
+class shared_cache:
+    """
+    Parsed tables and decoded trees kept in memory and shared by every job of a run.
+
+    Tables are keyed by path and modification time, trees by the SHA-1 of the
+    tree region, so jobs on different ROMs with the same dictionary share them.
+    Trees are loaded lazily from the tree_cache and written back the first time
+    they are built. Without disk, trees only live in memory and the cache folder
+    is never read or written.
+    """
+    def __init__(self, disk=True):
+        self.disk = disk
+        self.tables = {}
+        self.trees = {}
+
+    def tree_state(self, tree_data):
+        """
+        Returns (digest, state) of a tree region, loading the state from the tree_cache once.
+        """
+        digest = hashlib.sha1(tree_data).hexdigest()
+        state = self.trees.get(digest)
+        if state is None:
+            state = self.trees[digest] = tree_cache.load(digest) if self.disk else {}
+        return digest, state
+
+    def load_table(self, tbl_file):
+        """
+        Returns the compiled_table of a .tbl file, loaded only once.
+        """
+        key = (os.path.abspath(tbl_file), os.path.getmtime(tbl_file))
+        if key not in self.tables:
+            self.tables[key] = compiled_table.load(tbl_file)
+        return self.tables[key]
+
+    def decode_table(self, tree_data):
+        """
+        Returns the huffman_table of a tree region, built only once.
+
+        With the cache folder enabled, the table is completed and stored, so
+        later runs and pool workers never walk the tree.
+        """
+        digest, state = self.tree_state(tree_data)
+        if "table" not in state:
+            table = huffman_table(tree_data)
+            if "decode" in state:
+                table.tables = state["decode"]
+            elif self.disk and tree_cache.path(digest) is not None:
+                table.build_all()
+                state["decode"] = table.tables
+                tree_cache.store(digest, state)
+            state["table"] = table
+        return state["table"]
+
+    def symbol_lut(self, tree_data):
+        """
+        Returns the compressor SymbolLUT of a tree region, built only once.
+        """
+        digest, state = self.tree_state(tree_data)
+        if "lut" not in state:
+            state["lut"] = insertion.build_symbol_lut(tree_data, 0)
+            if self.disk:
+                tree_cache.store(digest, state)
+        return state["lut"]
+
+class line_index:
+    """
+    Start of every script line, for decoding a single line without the text
+    before it. Lines start where symbols 01-04 break the text.
+
+    Each line stores the byte of the stream (chunk) and the tree node where
+    decoding has to restart, the symbols of that byte that still belong to the
+    previous line (skip) and its symbol count. The columns are arrays, the
+    lines of block n are rows[n-1] to rows[n].
+
+    Sidecar file format (little endian):
+        "DKC3LIDX", version (2), blocks (4), lines (4), SHA-1 of the tree and pointer table (20)
+        addrs[blocks] (4), rows[blocks + 1] (4), chunks[lines] (4), nodes[lines] (2),
+        skips[lines] (2), counts[lines] (4)
+    """
+    MAGIC = b"DKC3LIDX"
+    HEADER = struct.Struct("<8sHII20s")
+    COLUMNS = (("addrs", "I"), ("rows", "I"), ("chunks", "I"), ("nodes", "H"), ("skips", "H"), ("counts", "I"))
+
+    def __init__(self, digest=b""):
+        self.digest = digest
+        for name, typecode in line_index.COLUMNS:
+            setattr(self, name, array.array(typecode))
+        self.rows.append(0)
+
+    def digest_of(rom_data, layout):
+        """
+        Returns the SHA-1 of the tree and pointer table regions, the index is only valid for them.
+        """
+        digest = hashlib.sha1(rom_data[layout["TREE_START_OFFSET"]:layout["TREE_END_OFFSET"] + 1])
+        digest.update(rom_data[layout["PTR_START_OFFSET"]:layout["PTR_END_OFFSET"] + 1])
+        return digest.digest()
+
+    def build(rom_data, table, symbol_text, ptr_array, length_array, digest=b""):
+        """
+        Decodes every block once and records the start of its lines.
+
+        Returns:
+            line_index: The index of every block.
+        """
+        index = line_index(digest)
+        for addr, length in zip(ptr_array, length_array):
+            index.add_block(rom_data, table, symbol_text, addr, length)
+        return index
+
+    def add_block(self, rom_data, table, symbol_text, addr, length):
+        lookup = table.lookup
+        state = table.root
+        output = bytearray()
+        starts = []
+        nodes = []
+        pos = addr
+
+        while len(output) < length:
+            for byte_addr in (pos + 1, pos):
+                if len(output) >= length:
+                    break
+                starts.append(len(output))
+                nodes.append(state)
+                symbols, state = lookup(state, rom_data[byte_addr])
+                output.extend(symbols)
+            pos += 2
+        del output[length:]
+
+        # Same lines as extraction.symbols_to_lines: an empty last line is
+        # dropped, then an empty first line
+        breaks = [i for i, symbol in enumerate(output) if 1 <= symbol <= 4]
+        segments = list(zip([0] + breaks, breaks + [length]))
+        if segments and not "".join(symbol_text[symbol] for symbol in output[segments[-1][0]:]):
+            segments.pop()
+        if segments and not "".join(symbol_text[symbol] for symbol in output[segments[0][0]:segments[0][1]]):
+            segments.pop(0)
+
+        for start, end in segments:
+            chunk = bisect.bisect_right(starts, start) - 1
+            self.chunks.append(chunk)
+            self.nodes.append(nodes[chunk])
+            self.skips.append(start - starts[chunk])
+            self.counts.append(end - start)
+        self.addrs.append(addr)
+        self.rows.append(len(self.chunks))
+
+    def line_count(self, block):
+        return self.rows[block] - self.rows[block - 1]
+
+    def decode_line(self, rom_data, table, symbol_text, block, line):
+        """
+        Decodes one line (both 1-based) of a block.
+
+        Returns:
+            str: The line, as written by extract.
+        """
+        if not 1 <= block <= len(self.addrs):
+            raise IndexError(f"block {block} out of range 1-{len(self.addrs)}")
+        if not 1 <= line <= self.line_count(block):
+            raise IndexError(f"line {line} out of range 1-{self.line_count(block)} in block {block}")
+        row = self.rows[block - 1] + line - 1
+        skip = self.skips[row]
+        symbols = extraction.decode_symbols(rom_data, table, self.addrs[block - 1], skip + self.counts[row],
+                                            self.nodes[row], self.chunks[row])
+        return "".join(symbol_text[symbol] for symbol in symbols[skip:])
+
+    def write(self, index_file):
+        with open(index_file, "wb") as f:
+            f.write(line_index.HEADER.pack(line_index.MAGIC, LINE_INDEX_VERSION, len(self.addrs), len(self.chunks), self.digest))
+            for name, _ in line_index.COLUMNS:
+                column = getattr(self, name)
+                if sys.byteorder == "big":
+                    column = array.array(column.typecode, column)
+                    column.byteswap()
+                column.tofile(f)
+
+    def load(index_file):
+        """
+        Reads a sidecar written by write().
+
+        Returns:
+            line_index: The index.
+
+        Raises:
+            ValueError: The file is not a line index of this version.
+        """
+        with open(index_file, "rb") as f:
+            header = f.read(line_index.HEADER.size)
+            if len(header) != line_index.HEADER.size:
+                raise ValueError(f"{index_file} is not a line index")
+            magic, version, blocks, lines, digest = line_index.HEADER.unpack(header)
+            if magic != line_index.MAGIC or version != LINE_INDEX_VERSION:
+                raise ValueError(f"{index_file} is not a line index of version {LINE_INDEX_VERSION}")
+            index = line_index(digest)
+            index.rows = array.array("I")
+            sizes = {"addrs": blocks, "rows": blocks + 1}
+            for name, typecode in line_index.COLUMNS:
+                column = array.array(typecode)
+                try:
+                    column.fromfile(f, sizes.get(name, lines))
+                except EOFError:
+                    raise ValueError(f"{index_file} is truncated")
+                if sys.byteorder == "big":
+                    column.byteswap()
+                setattr(index, name, column)
+        return index
+
+class Dkc3Text:
+    """
+    Script of one language over a ROM image held in memory.
+
+    Blocks are decoded on first access and replaced in memory, build() compresses
+    them again and patch() writes the text and pointer table into a buffer.
+    Only the .tbl file is read from the disk. The cache folder (layouts and
+    trees) is used only through a cache given by the caller, like
+    shared_cache() of the command line runners.
+
+    Example:
+        with open("dkc3.sfc", "rb") as f:
+            text = Dkc3Text(f.read(), "en", "dkc3_en.tbl")
+        lines = text.block(1)
+        text.set_block(1, ["NEW TEXT"] + lines[1:])
+        rom = text.to_bytes()
+
+    Parameters:
+        rom (bytes, bytearray, mmap or memoryview): The ROM image.
+        lang (str): Language of the layout ("en" or "fr").
+        tbl (str or compiled_table): The .tbl file of the language.
+        cache (shared_cache): Tables and trees shared with other objects, an
+                              in-memory shared_cache(disk=False) when not given.
+        layout (dict): Custom layout with the same keys as LAYOUTS, found with
+                       find_layouts when not given.
+    """
+    def __init__(self, rom, lang="en", tbl=None, cache=None, layout=None):
+        if tbl is None:
+            tbl = f"dkc3_{lang}.tbl"
+        self.cache = shared_cache(disk=False) if cache is None else cache
+        self.rom = memoryview(rom)
+        self.lang = lang
+        if layout is None:
+            layout = find_layouts(self.rom, self.cache.disk).get(lang)
+            if layout is None:
+                raise ValueError(f"the {lang} script was not found, the ROM layout is unknown")
+        self.layout = get_layout(lang, layout)
+        self.table = tbl if isinstance(tbl, compiled_table) else self.cache.load_table(tbl)
+
+        tree_data = self.rom[self.layout["TREE_START_OFFSET"]:self.layout["TREE_END_OFFSET"] + 1]
+        self.decoder = self.cache.decode_table(tree_data)
+        self.SymbolLUT = self.cache.symbol_lut(tree_data)
+
+        ptr_table = self.rom[self.layout["PTR_START_OFFSET"]:self.layout["PTR_END_OFFSET"] + 1]
+        ptr_array, length_array = extraction.read_ptr_table(ptr_table, self.layout["TEXT_START_OFFSET"])
+        self.ptr_array = reverse_list(ptr_array)
+        self.length_array = reverse_list(length_array)
+        self.symbols = [None] * len(self.ptr_array)
+        self.lines = [None] * len(self.ptr_array)
+        self.compressed = [None] * len(self.ptr_array)
+        self.replaced = set()
+        self.index = None
+
+    @property
+    def block_count(self):
+        return len(self.ptr_array)
+
+    def check_block(self, block):
+        if not 1 <= block <= self.block_count:
+            raise IndexError(f"block {block} out of range 1-{self.block_count}")
+        return block - 1
+
+    def block_symbols(self, block):
+        """
+        Returns the symbols of a block (1-based), decoded once.
+        """
+        idx = self.check_block(block)
+        if self.symbols[idx] is None:
+            self.symbols[idx] = bytes(extraction.decode_symbols(self.rom, self.decoder, self.ptr_array[idx], self.length_array[idx]))
+        return self.symbols[idx]
+
+    def block(self, block):
+        """
+        Returns the lines of a block (1-based), as written by extract.
+        """
+        idx = self.check_block(block)
+        if self.lines[idx] is None:
+            self.lines[idx] = extraction.symbols_to_lines(self.block_symbols(block), self.table.symbols)
+        return list(self.lines[idx])
+
+    def blocks(self):
+        """
+        Returns the lines of every block.
+        """
+        return [self.block(block) for block in range(1, self.block_count + 1)]
+
+    def set_block(self, block, lines):
+        """
+        Replaces the text of a block (1-based). Lines are joined as insert does
+        with a script file, a single string is used as is.
+        """
+        idx = self.check_block(block)
+        self.symbols[idx] = bytes(insertion.encode_text([lines], self.table.trie, block)[0])
+        self.lines[idx] = None
+        self.compressed[idx] = None
+        self.replaced.add(idx)
+
+    def build_index(self):
+        """
+        Builds the line index of the ROM, used by decode_line().
+
+        Returns:
+            line_index: The index, save it with write().
+        """
+        self.index = line_index.build(self.rom, self.decoder, self.table.symbols, self.ptr_array, self.length_array,
+                                      line_index.digest_of(self.rom, self.layout))
+        return self.index
+
+    def load_index(self, index_file):
+        """
+        Loads a line index written by extract --index or line_index.write().
+
+        Raises:
+            ValueError: The index was built from another tree or pointer table.
+        """
+        index = line_index.load(index_file)
+        if index.digest != line_index.digest_of(self.rom, self.layout) or len(index.addrs) != self.block_count:
+            raise ValueError(f"{index_file} does not match the {self.lang} script of this ROM")
+        self.index = index
+
+    def decode_line(self, block, line):
+        """
+        Returns one line (both 1-based) of a block. With a line index, only
+        that line is decoded, otherwise the block is.
+        """
+        idx = self.check_block(block)
+        if self.index is None or idx in self.replaced or self.lines[idx] is not None:
+            lines = self.block(block)
+            if not 1 <= line <= len(lines):
+                raise IndexError(f"line {line} out of range 1-{len(lines)} in block {block}")
+            return lines[line - 1]
+        return self.index.decode_line(self.rom, self.decoder, self.table.symbols, block, line)
+
+    def block_compressed(self, block):
+        """
+        Returns (block_bytes, symbols) of a block (1-based), compressed once.
+        """
+        idx = self.check_block(block)
+        if self.compressed[idx] is None:
+            self.compressed[idx] = insertion.compress_block(self.block_symbols(block), self.SymbolLUT, block)
+        return self.compressed[idx]
+
+    def build(self):
+        """
+        Compresses every block, only blocks replaced since the last build are compressed again.
+
+        Returns:
+            tuple: (text_data, ptr_table)
+
+        Raises:
+            ValueError: The text or the pointer table does not fit its region.
+        """
+        compressed_blocks = [self.block_compressed(block) for block in range(1, self.block_count + 1)]
+        text_data, text_size, symbol_count, block_offsets = insertion.pack_blocks(compressed_blocks, 0x0)
+        ptr_table, ptr_size = insertion.create_4_bytes_pointers(symbol_count, block_offsets)
+        if text_size > self.layout["TEXT_LIMIT"]:
+            raise ValueError(f"script size has exceeded its maximum size by {text_size - self.layout['TEXT_LIMIT']} bytes")
+        if ptr_size > self.layout["PTR_SIZE"]:
+            raise ValueError(f"table pointer size has exceeded its maximum size by {ptr_size - self.layout['PTR_SIZE']} bytes")
+        return text_data, ptr_table
+
+    def patch(self, buffer):
+        """
+        Writes the text and the pointer table into a writable buffer holding the ROM.
+        """
+        text_data, ptr_table = self.build()
+        buffer = memoryview(buffer)
+        TEXT_START_OFFSET = self.layout["TEXT_START_OFFSET"]
+        PTR_START_OFFSET = self.layout["PTR_START_OFFSET"]
+        buffer[TEXT_START_OFFSET:TEXT_START_OFFSET + len(text_data)] = text_data
+        buffer[PTR_START_OFFSET:PTR_START_OFFSET + len(ptr_table)] = ptr_table
+        return buffer
+
+    def to_bytes(self):
+        """
+        Returns a patched copy of the ROM.
+        """
+        data = bytearray(self.rom)
+        self.patch(data)
+        return data
+
+class script_watcher:
+    """
+    Reports changed script files. inotify is used on Linux, the modification
+    times are polled every interval seconds otherwise.
+    """
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+
+    def __init__(self, paths, interval=0.25, poll=False):
+        self.paths = {os.path.abspath(path) for path in paths}
+        self.interval = interval
+        self.mtimes = {path: script_watcher.mtime(path) for path in self.paths}
+        self.fd = None
+        self.dirs = {}
+        if not poll:
+            try:
+                self.fd, self.dirs = script_watcher.inotify({os.path.dirname(path) for path in self.paths})
+            except (OSError, AttributeError, TypeError):
+                self.fd = None
+
+    def mtime(path):
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    def inotify(directories):
+        """
+        Watches the folders of the scripts with inotify through libc.
+
+        Returns:
+            tuple: (fd, dirs) the inotify descriptor and the folder of every watch.
+        """
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        fd = libc.inotify_init1(os.O_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        dirs = {}
+        for directory in directories:
+            wd = libc.inotify_add_watch(fd, os.fsencode(directory), script_watcher.IN_CLOSE_WRITE | script_watcher.IN_MOVED_TO)
+            if wd < 0:
+                os.close(fd)
+                raise OSError(ctypes.get_errno(), f"inotify_add_watch failed on {directory}")
+            dirs[wd] = directory
+        return fd, dirs
+
+    @property
+    def mode(self):
+        return "inotify" if self.fd is not None else "polling"
+
+    def changes(self):
+        """
+        Waits until at least one script changes.
+
+        Returns:
+            set[str]: Absolute paths of the changed scripts.
+        """
+        while True:
+            if self.fd is not None:
+                changed = self.read_events()
+            else:
+                time.sleep(self.interval)
+                changed = set()
+                for path in self.paths:
+                    mtime = script_watcher.mtime(path)
+                    if mtime != self.mtimes[path]:
+                        self.mtimes[path] = mtime
+                        changed.add(path)
+            if changed:
+                return changed
+
+    def read_events(self):
+        select.select([self.fd], [], [])
+        data = os.read(self.fd, 65536)
+        changed = set()
+        offset = 0
+        while offset + 16 <= len(data):
+            # struct inotify_event: wd, mask, cookie, len, name[len]
+            wd, mask, cookie, name_len = struct.unpack_from("iIII", data, offset)
+            name = data[offset + 16:offset + 16 + name_len].rstrip(b"\0")
+            offset += 16 + name_len
+            path = os.path.join(self.dirs.get(wd, ""), os.fsdecode(name))
+            if path in self.paths:
+                changed.add(path)
+        return changed
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+class layout_detector:
+    """
+    Finds the pointer tables, Huffman trees and text regions of a ROM image.
+
+    ROMs are recognised by the CRC32 of the image without its copier header.
+    Other ROMs are checked against the default layout first and scanned when
+    it doesn't match: pointer tables are found by the shape of their offsets,
+    trees by walking every candidate root in the banks of the tables, and the
+    text base of a table by decoding its blocks at every bank start (or up to
+    ALIGN_GAP bytes after the text of the previous language) until each block
+    ends where the next one starts. Tables written by insert --dedup, whose
+    blocks share offsets or start inside other blocks, are accepted when their
+    blocks cover the text without gaps. Scripts are matched to the languages by
+    the size of their tree and text, not by their place in the ROM. Layouts
+    found by scanning are cached by CRC32.
+    """
+    BANK_SIZE = 0x8000
+    ALIGN_GAP = 0x100
+    TREE_MAX_SIZE = 0x1000
+    # Blocks decoded to accept a candidate before checking the whole table
+    CHECK_BLOCKS = 4
+
+    def header_size(size):
+        """
+        Returns the size of the copier header of a ROM image (512 bytes or none).
+        """
+        return 512 if size % 1024 == 512 else 0
+
+    def shift(layout, offset):
+        return {key: value + offset if key.endswith("_OFFSET") else value for key, value in layout.items()}
+
+    def get_ushort(data, index):
+        return data[index] | (data[index + 1] << 8)
+
+    def ptr_table(data, addr):
+        """
+        Returns (offsets, lengths, stored) of the scripts when addr holds a valid
+        pointer table (see stored), None otherwise.
+        """
+        if addr < 0 or addr + PTR_ENTRIES * 4 > len(data):
+            return None
+        offsets, lengths = extraction.read_ptr_table(data[addr:addr + PTR_ENTRIES * 4], 0)
+        offsets = reverse_list(offsets)
+        lengths = reverse_list(lengths)
+        stored = layout_detector.stored(offsets, lengths)
+        if stored is None:
+            return None
+        return offsets, lengths, stored
+
+    def packed(offsets, lengths):
+        """
+        Checks that every block starts where the previous one ends, the layout of the game and of insert.
+        """
+        if offsets[0] != 0 or lengths[-1] == 0:
+            return False
+        for i in range(len(offsets) - 1):
+            # Symbols take 1 to 16 bits and blocks are padded to 16 bits
+            size = offsets[i + 1] - offsets[i]
+            if not (lengths[i] + 15) // 16 * 2 <= size <= lengths[i] * 2:
+                return False
+        return True
+
+    def stored(offsets, lengths):
+        """
+        Returns the indexes of the blocks stored in the text, in order: every
+        block of a packed table, or for a table written by insert --dedup the
+        blocks that still follow each other like in packed(), every other block
+        pointing inside one of them. Most blocks hold text and only repeated text
+        is shared, so most blocks have to be stored. None when the table has
+        neither shape.
+        """
+        if lengths.count(0) * 2 >= len(lengths):
+            return None
+        if layout_detector.packed(offsets, lengths):
+            return list(range(len(offsets)))
+        if 0 in lengths:
+            return None
+        # Longest chain of stored blocks ending at every block, from a block at offset 0
+        chains = [[i] if offsets[i] == 0 else None for i in range(len(offsets))]
+        for i in range(len(offsets)):
+            for j in range(i):
+                size = offsets[i] - offsets[j]
+                if (chains[j] is not None and (lengths[j] + 15) // 16 * 2 <= size <= lengths[j] * 2
+                        and (chains[i] is None or len(chains[j]) >= len(chains[i]))):
+                    chains[i] = chains[j] + [i]
+        for chain in sorted((chain for chain in chains if chain is not None), key=len, reverse=True):
+            if len(chain) * 2 > len(offsets) and all(
+                    any(offsets[j] <= offset < offsets[j] + lengths[j] * 2 for j in chain) for offset in offsets):
+                return chain
+        return None
+
+    def tree(data, start):
+        """
+        Returns the size of the tree at start (root word included) when it's a
+        valid tree, None otherwise. Every node has two children or none, leaves
+        have distinct symbols.
+        """
+        get_ushort = layout_detector.get_ushort
+        base = start + 2
+        if base > len(data):
+            return None
+        root = get_ushort(data, start)
+        nodes = set()
+        symbols = set()
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            if node in nodes or not 1 <= node < layout_detector.TREE_MAX_SIZE or base + node + 4 > len(data):
+                return None
+            nodes.add(node)
+            one = get_ushort(data, base + node)
+            zero = get_ushort(data, base + node + 2)
+            if one == 0 and zero == 0:
+                symbol = data[base + node - 1]
+                if symbol in symbols:
+                    return None
+                symbols.add(symbol)
+            elif one != 0 and zero != 0:
+                stack.append(one)
+                stack.append(zero)
+            else:
+                return None
+        if len(symbols) < 2:
+            return None
+        return 2 + max(nodes) + 4
+
+    def consumed(data, table, addr, length):
+        """
+        Returns the number of bytes read to decode length symbols at addr, None past the end of data.
+        """
+        lookup = table.lookup
+        state = table.root
+        count = 0
+        size = 0
+        try:
+            while count < length:
+                # High byte of every word first
+                symbols, state = lookup(state, data[addr + (size & ~1) + (0 if size & 1 else 1)])
+                count += len(symbols)
+                size += 1
+        except IndexError:
+            return None
+        return size
+
+    def text_end(data, table, base, offsets, lengths, stored, blocks=None):
+        """
+        Decodes the blocks of a pointer table at base and checks that each stored
+        block ends where the next one starts, and that the shared blocks of a
+        table written by insert --dedup end inside the stored ones.
+
+        Returns:
+            int: End of the last block checked (relative to base), None when a block doesn't match.
+        """
+        count = len(stored) if blocks is None else min(blocks, len(stored))
+        end = 0
+        for k in range(count):
+            i = stored[k]
+            size = layout_detector.consumed(data, table, base + offsets[i], lengths[i])
+            if size is None:
+                return None
+            if k + 1 < len(stored):
+                # The last symbol is only known at the next bit, one more byte may be read
+                gap = offsets[stored[k + 1]] - offsets[i]
+                if not gap - 1 <= size <= gap + 1:
+                    return None
+                end = offsets[stored[k + 1]]
+            else:
+                end = offsets[i] + (size + 1) // 2 * 2
+        members = set(stored)
+        for i in range(len(offsets)):
+            if i in members or (blocks is not None and offsets[i] >= end):
+                continue
+            size = layout_detector.consumed(data, table, base + offsets[i], lengths[i])
+            if size is None or offsets[i] + size > end + 1:
+                return None
+        return end
+
+    def matches(data, layout):
+        """
+        Checks a layout against a ROM image: pointer table, tree and the first blocks.
+        """
+        ptrs = layout_detector.ptr_table(data, layout["PTR_START_OFFSET"])
+        if ptrs is None or layout_detector.tree(data, layout["TREE_START_OFFSET"]) is None:
+            return False
+        table = huffman_table(data[layout["TREE_START_OFFSET"]:layout["TREE_END_OFFSET"] + 1])
+        return layout_detector.text_end(data, table, layout["TEXT_START_OFFSET"], *ptrs, layout_detector.CHECK_BLOCKS) is not None
+
+    def scan_ptr_tables(data):
+        """
+        Returns the address of every valid pointer table.
+        """
+        span = PTR_ENTRIES * 4
+        if len(data) < span:
+            return []
+        if np is not None:
+            rom = np.frombuffer(data, dtype=np.uint8)
+            words = rom[:-1].astype(np.uint16) | (rom[1:].astype(np.uint16) << 8)
+            count = len(data) - span + 1
+
+            def offset(entry):
+                return words[entry * 4 + 2:entry * 4 + 2 + count]
+
+            def length(entry):
+                return words[entry * 4:entry * 4 + count]
+
+            # Scripts 19..1 are stored in reverse, script 1 starts at offset 0
+            mask = (offset(PTR_ENTRIES - 2) == 0) & (offset(0) > 0) & (offset(PTR_ENTRIES - 1) >= offset(0))
+            for entry in range(PTR_ENTRIES - 2):
+                mask &= offset(entry) >= offset(entry + 1)
+            # Tables written by insert --dedup only have some block with symbols at offset 0
+            shared = np.zeros(count, dtype=bool)
+            for entry in range(PTR_ENTRIES):
+                shared |= (offset(entry) == 0) & (length(entry) > 0)
+            candidates = np.flatnonzero(mask | shared).tolist()
+        else:
+            # Same first filter with the regex engine: an entry with symbols at offset 0,
+            # the table starts at most PTR_ENTRIES - 1 entries before it
+            pattern = re.compile(b"(?=(?!\\x00\\x00)..\\x00\\x00)", re.DOTALL)
+            candidates = sorted({match.start() - entry * 4 for match in pattern.finditer(data)
+                                 for entry in range(PTR_ENTRIES) if 0 <= match.start() - entry * 4 <= len(data) - span})
+        tables = {}
+        for addr in candidates:
+            ptrs = layout_detector.ptr_table(data, addr)
+            if ptrs is not None:
+                tables[addr] = len(ptrs[2]) == PTR_ENTRIES
+        # Tables don't overlap, a --dedup table over a packed one is a shifted view of it
+        packed = [addr for addr, full in tables.items() if full]
+        return [addr for addr, full in tables.items()
+                if full or not any(abs(addr - other) < span for other in packed)]
+
+    def scan_trees(data, start, end):
+        """
+        Returns (start, size) of every valid tree between start and end.
+        """
+        trees = []
+        for addr in range(start, min(end, len(data) - 2)):
+            root = layout_detector.get_ushort(data, addr)
+            if 1 <= root < layout_detector.TREE_MAX_SIZE:
+                size = layout_detector.tree(data, addr)
+                if size is not None:
+                    trees.append((addr, size))
+        return trees
+
+    def scan(data, header):
+        """
+        Scans a ROM image for the scripts of every language.
+
+        Returns:
+            dict: {lang: layout} for the languages found.
+        """
+        tables = layout_detector.scan_ptr_tables(data)
+        banks = sorted({(addr - header) // 0x10000 for addr in tables})
+        trees = []
+        for bank in banks:
+            trees.extend(layout_detector.scan_trees(data, header + bank * 0x10000, header + (bank + 1) * 0x10000 + 2))
+        bank_bases = list(range(header, len(data), layout_detector.BANK_SIZE))
+
+        found = []
+        next_bases = []
+        for ptr_start in tables:
+            offsets, lengths, stored = layout_detector.ptr_table(data, ptr_start)
+            match = None
+            for tree_start, tree_size in trees:
+                table = huffman_table(data[tree_start:tree_start + tree_size])
+                for base in next_bases + bank_bases:
+                    if base + offsets[-1] >= len(data):
+                        continue
+                    if layout_detector.text_end(data, table, base, offsets, lengths, stored, layout_detector.CHECK_BLOCKS) is None:
+                        continue
+                    end = layout_detector.text_end(data, table, base, offsets, lengths, stored)
+                    if end is not None:
+                        match = (ptr_start, tree_start, tree_size, base, end)
+                        break
+                if match:
+                    break
+            if match:
+                found.append(match)
+                # The next language usually starts right after this one, maybe aligned
+                next_bases = list(range(match[3] + match[4] - 2, match[3] + match[4] + layout_detector.ALIGN_GAP))
+
+        starts = sorted({addr for entry in found for addr in (entry[0], entry[1], entry[3])})
+        layouts = {}
+        for lang, (ptr_start, tree_start, tree_size, base, end) in layout_detector.assign(found):
+            # The tree region goes on over its zero padding (up to ALIGN_GAP bytes),
+            # the text over the free space (00 or FF bytes) after it in the same bank
+            tree_end = tree_start + tree_size
+            stop = min([addr for addr in starts if addr >= tree_end] + [tree_end + layout_detector.ALIGN_GAP, len(data)])
+            while tree_end < stop and data[tree_end] == 0:
+                tree_end += 1
+            bank_end = header + ((base - header) // 0x10000 + 1) * 0x10000
+            stop = min([addr for addr in starts if addr > base] + [bank_end, len(data)])
+            limit = end
+            if base + end < stop and data[base + end] in (0x00, 0xFF):
+                filler = data[base + end]
+                while base + limit < stop and data[base + limit] == filler:
+                    limit += 1
+            layouts[lang] = {
+                "PTR_START_OFFSET": ptr_start,
+                "PTR_END_OFFSET": ptr_start + PTR_ENTRIES * 4 - 1,
+                "TREE_START_OFFSET": tree_start,
+                "TREE_END_OFFSET": tree_end - 1,
+                "TEXT_START_OFFSET": base,
+                "TEXT_END_OFFSET": base + end - 1,
+                "TEXT_LIMIT": limit,
+            }
+        return layouts
+
+    def assign(found):
+        """
+        Pairs the scripts found by scan with the languages. A script goes to the
+        language whose default layout has the closest tree size (the number of
+        characters of the language) and text size, relative to the defaults.
+        Every language gets one script at most.
+
+        Parameters:
+            found (list[tuple]): (ptr_start, tree_start, tree_size, base, end) of every script.
+
+        Returns:
+            list[tuple]: (lang, script) pairs.
+        """
+        def distance(lang, entry):
+            layout = get_layout(lang)
+            return (abs(entry[2] - layout["TREE_SIZE"]) / layout["TREE_SIZE"] +
+                    abs(entry[4] - layout["TEXT_SIZE"]) / layout["TEXT_SIZE"])
+
+        langs = list(LAYOUTS)
+        if len(found) >= len(langs):
+            pairings = ([(lang, found[i]) for lang, i in zip(langs, order)]
+                        for order in itertools.permutations(range(len(found)), len(langs)))
+        else:
+            pairings = (list(zip(order, found)) for order in itertools.permutations(langs, len(found)))
+        return min(pairings, key=lambda pairs: sum(distance(lang, entry) for lang, entry in pairs), default=[])
+
+    def cache_path():
+        cache_dir = get_cache_dir()
+        if cache_dir is None:
+            return None
+        return os.path.join(cache_dir, "layouts.json")
+
+    def load_cache():
+        path = layout_detector.cache_path()
+        if path is None or not os.path.exists(path):
+            return {}
+        try:
+            with open(path, "r", encoding="UTF-8") as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if cache.get("version") != LAYOUT_CACHE_VERSION:
+            return {}
+        return cache.get("roms", {})
+
+    def store_cache(crc, layouts):
+        """
+        Stores the layouts of a ROM (relative to the image without header), the
+        oldest entries are removed past LAYOUT_CACHE_ENTRIES.
+        """
+        path = layout_detector.cache_path()
+        if path is None:
+            return
+        roms = layout_detector.load_cache()
+        roms.pop(crc, None)
+        roms[crc] = layouts
+        roms = dict(list(roms.items())[-LAYOUT_CACHE_ENTRIES:])
+        write_cache_file(path, json.dumps({"version": LAYOUT_CACHE_VERSION, "roms": roms}, indent=1).encode("UTF-8"))
+
+def find_layouts(data, disk=True):
+    """
+    Returns the layout of every language of a ROM image (bytes, mmap or memoryview).
+
+    Known ROMs are recognised by CRC32, a copier header moves every offset by
+    512 bytes. Other ROMs use the default layout when it matches the image and
+    are scanned otherwise, the scan is cached by CRC32 unless disk is False.
+    Languages the scan doesn't find keep the default layout when its tree is
+    valid, so scripts can still be inserted into a ROM with a blank text region,
+    with a warning.
+
+    Returns:
+        dict: {lang: layout}, empty when no script was found.
+    """
+    header = layout_detector.header_size(len(data))
+    image = memoryview(data)[header:]
+    crc = zlib.crc32(image)
+    if crc in KNOWN_ROMS:
+        return {lang: layout_detector.shift(layout, header) for lang, layout in KNOWN_ROMS[crc].items()}
+
+    key = f"{crc:08X}"
+    cached = layout_detector.load_cache().get(key) if disk else None
+    if cached is not None:
+        return {lang: layout_detector.shift(layout, header) for lang, layout in cached.items()}
+
+    defaults = {lang: layout_detector.shift(layout, header) for lang, layout in LAYOUTS.items()}
+    if all(layout_detector.matches(data, layout) for layout in defaults.values()):
+        # Checking the defaults is cheap, only scans are worth a cache entry
+        return defaults
+
+    layouts = layout_detector.scan(data, header)
+    for lang, layout in defaults.items():
+        if lang not in layouts and layout_detector.tree(data, layout["TREE_START_OFFSET"]) is not None:
+            print(f"Warning: the {lang} script was not found, the default {lang} layout is used.")
+            layouts[lang] = layout
+    if disk:
+        layout_detector.store_cache(key, {lang: layout_detector.shift(layout, -header) for lang, layout in layouts.items()})
+    return layouts
+
+def rom_layout(layouts, lang, rom_file):
+    """
+    Returns the layout of a language found by find_layouts, sizes included.
+    The process stops with an error when the language wasn't found.
+    """
+    if lang not in layouts:
+        print(f"ERROR: the {lang} script was not found in {rom_file}, the ROM layout is unknown.")
+        sys.exit(1)
+    return get_layout(lang, layouts[lang])
+
+def get_layout(lang, layout=None):
+    """
+    Returns the ROM layout constants of a language, sizes included.
+    A custom layout with the same keys as LAYOUTS can be given instead.
+    """
+    layout = dict(LAYOUTS[lang] if layout is None else layout)
+    layout["PTR_SIZE"] = layout["PTR_END_OFFSET"] - layout["PTR_START_OFFSET"] + 1
+    layout["TREE_SIZE"] = layout["TREE_END_OFFSET"] - layout["TREE_START_OFFSET"] + 1
+    layout["TEXT_SIZE"] = layout["TEXT_END_OFFSET"] - layout["TEXT_START_OFFSET"] + 1
+    return layout
+
+def lang_file(path, lang, append=False):
+    """
+    Expands the {lang} placeholder of a file name. Without placeholder the
+    language is appended to the name when append is set.
+    """
+    if "{lang}" in path:
+        return path.replace("{lang}", lang)
+    if append:
+        return f"{path}_{lang}"
+    return path
+
+def run_tasks(executor, tasks):
+    """
+    Runs (function, args) tasks in the process pool, or inline when there is no pool.
+
+    Returns:
+        list: The results, in the same order as the tasks.
+    """
+    if executor is None:
+        return [func(*func_args) for func, func_args in tasks]
+    futures = [executor.submit(func, *func_args) for func, func_args in tasks]
+    return [future.result() for future in futures]
+
+def split_groups(count, jobs):
+    """
+    Splits range(count) into at most jobs contiguous groups.
+    """
+    groups = max(1, min(jobs, count))
+    size = -(-count // groups)
+    return [range(i, min(i + size, count)) for i in range(0, count, size)]
+
+def run_extract(rom_file, tbl_file, out_file, langs, jobs=1, executor=None, cache=None, profiler=None, script_format="txt",
+                index=False):
+    """
+    Extracts the scripts of every language in langs.
+
+    Blocks are decompressed across the process pool when one is given, the
+    languages are submitted together so they run concurrently. Workers load
+    the tables themselves (see extraction.init_worker). With the jsonl
+    or po script_format, each language is written to a single file. With index,
+    the line index of every language is written to <out_file>_<lang>.idx.
+
+    Returns:
+        dict: Job statistics (blocks, symbols, bytes).
+    """
+    if cache is None:
+        cache = shared_cache()
+    if profiler is None:
+        profiler = stage_profiler()
+    stats = {"blocks": 0, "symbols": 0, "bytes": 0}
+    jobs_list = []
+    tasks = []
+    with rom_session(rom_file) as rom:
+        layouts = find_layouts(rom.data)
+        for lang in langs:
+            layout = rom_layout(layouts, lang, rom_file)
+            PTR_START_OFFSET = layout["PTR_START_OFFSET"]
+            PTR_SIZE = layout["PTR_SIZE"]
+            TREE_START_OFFSET = layout["TREE_START_OFFSET"]
+            TREE_SIZE = layout["TREE_SIZE"]
+            BASE = layout["TEXT_START_OFFSET"]
+
+            # Load Tbl
+            lang_tbl_file = lang_file(tbl_file, lang)
+            with profiler.stage("tbl_load", lang):
+                tbl_dict = cache.load_table(lang_tbl_file)
+
+            with profiler.stage("ptr_read", lang):
+                # Get Pointers
+                ptr_table = extraction.read_rom(rom, PTR_START_OFFSET, PTR_SIZE)
+
+                # Split ptr and lenghts
+                ptr_array, length_array = extraction.read_ptr_table(ptr_table, BASE)
+                ptr_array = reverse_list(ptr_array)
+                length_array = reverse_list(length_array)
+
+            with profiler.stage("tree_build", lang):
+                table = cache.decode_table(extraction.read_rom(rom, TREE_START_OFFSET, TREE_SIZE))
+
+            # Index the start of every line
+            if index:
+                with profiler.stage("index", lang):
+                    index_file = f"{lang_file(out_file, lang)}_{lang}.idx"
+                    line_index.build(rom.data, table, tbl_dict.symbols, ptr_array, length_array,
+                                     line_index.digest_of(rom.data, layout)).write(index_file)
+                print(f"Line index written to {index_file}")
+
+            # Decomprees
+            groups = split_groups(len(ptr_array), jobs)
+            jobs_list.append((lang, layout, ptr_array, length_array, len(groups)))
+            for group in groups:
+                ptrs = ptr_array[group.start:group.stop]
+                lengths = length_array[group.start:group.stop]
+                if executor is None:
+                    tasks.append((extraction.huffman_decompress, (rom.data, tbl_dict, TREE_START_OFFSET, TREE_SIZE, ptrs, lengths, table)))
+                else:
+                    # Workers build their own tables, only the file names and offsets are sent
+                    tasks.append((extraction.decompress_task, (rom_file, lang_tbl_file, TREE_START_OFFSET, TREE_SIZE, ptrs, lengths)))
+            stats["blocks"] += len(ptr_array)
+            stats["symbols"] += sum(length_array)
+            stats["bytes"] += layout["TEXT_SIZE"]
+
+            # Block sizes come from the distance to the next block, the size of the
+            # last block and the bit counts are not stored in the ROM and are left out
+            starts = sorted(set(ptr_array))
+            for i, (pos, length) in enumerate(zip(ptr_array, length_array), start=1):
+                end = next((start for start in starts if start > pos), None)
+                profiler.block(lang, i, length, None, end - pos if end is not None else None)
+
+        with profiler.stage("decode", ",".join(langs)):
+            results = run_tasks(executor, tasks)
+
+    for lang, layout, ptr_array, length_array, group_count in jobs_list:
+        decompress_blocks = []
+        for _ in range(group_count):
+            decompress_blocks.extend(results.pop(0))
+
+        # Write script
+        with profiler.stage("script_write", lang):
+            base_out_file = lang_file(out_file, lang)
+            if script_format == "txt":
+                for i, block_text in enumerate(decompress_blocks, start=1):
+                    out_file_i = f"{base_out_file}_{lang}_{i}.txt"
+                    extraction.write_out_file(out_file_i, block_text, ptr_array[i-1], length_array[i-1])
+                    print(f"Text extracted to {out_file_i}")
+            else:
+                out_file_lang = f"{base_out_file}_{lang}.{script_format}"
+                if script_format == "jsonl":
+                    extraction.write_jsonl(out_file_lang, decompress_blocks, ptr_array, length_array)
+                else:
+                    extraction.write_po(out_file_lang, decompress_blocks, ptr_array, length_array)
+                print(f"Text extracted to {out_file_lang}")
+        print(f"TEXT BLOCK SIZE: {layout['TEXT_SIZE']} / {hex(layout['TEXT_SIZE'])} bytes.")
+        print(f"PTR_TABLE BLOCK SIZE: {layout['PTR_SIZE']} / {hex(layout['PTR_SIZE'])} bytes.")
+        print("Extraction complete.\n")
+
+    return stats
+
+def run_insert(rom_file, tbl_file, script_file, langs, incremental=False, jobs=1, executor=None, cache=None, rebuild_tree=False, profiler=None,
+               out_rom=None, output_patch=None, script_format="txt", verify=False, dedup=False):
+    """
+    Inserts the scripts of every language in langs.
+
+    Changed blocks are encoded and compressed across the process pool when one
+    is given. Every language is written through the same ROM session, so nothing
+    reaches the disk unless all of them fit. With rebuild_tree, a new Huffman tree
+    is built from the scripts and written over the original one. With out_rom
+    and/or output_patch, the ROM file is left untouched and a patched copy
+    and/or an IPS/BPS patch is written instead. Scripts are read from a single
+    .jsonl/.po file per language with the jsonl or po script_format, .txt scripts
+    are streamed line by line and never held in memory whole. With verify,
+    the new text is decoded in memory and compared with the encoded scripts
+    before anything is written. With dedup, blocks repeated in other blocks
+    share their storage.
+
+    Returns:
+        dict: Job statistics (blocks, symbols, bytes).
+    """
+    if cache is None:
+        cache = shared_cache()
+    if profiler is None:
+        profiler = stage_profiler()
+    stats = {"blocks": 0, "symbols": 0, "bytes": 0}
+    BASE = 0x0
+
+    with rom_session(rom_file, writable=True, out_rom=out_rom, patch_file=output_patch) as rom:
+        layouts = find_layouts(rom.data)
+        jobs_list = []
+        tasks = []
+        for lang in langs:
+            layout = rom_layout(layouts, lang, rom_file)
+            TREE_START_OFFSET = layout["TREE_START_OFFSET"]
+            TREE_SIZE = layout["TREE_SIZE"]
+
+            # Load Tbl
+            with profiler.stage("tbl_load", lang):
+                lang_tbl_file = lang_file(tbl_file, lang)
+                tbl_trie = cache.load_table(lang_tbl_file).trie
+
+            # Read Script, .txt scripts are kept as paths and streamed where they are encoded
+            from_files = script_format == "txt"
+            with profiler.stage("script_read", lang):
+                base_in_file = lang_file(script_file, lang, append=len(langs) > 1)
+                if from_files:
+                    all_scripts = insertion.script_files(base_in_file)
+                else:
+                    all_scripts = insertion.read_scripts(base_in_file, script_format)
+
+            # Build a new tree from the script frequencies
+            tree_data = rom.read(TREE_START_OFFSET, TREE_SIZE)
+            if rebuild_tree:
+                with profiler.stage("tree_rebuild", lang):
+                    script_lines = [insertion.script_lines(script, from_files) for script in all_scripts]
+                    tree_data = insertion.rebuild_tree(insertion.encode_text(script_lines, tbl_trie), TREE_SIZE)
+                    insertion.write_rom(rom, TREE_START_OFFSET, TREE_SIZE, tree_data, False, 0x00)
+
+            # Reuse unchanged blocks from the manifest
+            cached_blocks = {}
+            manifest = None
+            if incremental:
+                manifest_file = f"{base_in_file}.manifest.json"
+                with open(lang_tbl_file, "rb") as f:
+                    table_hash = hashlib.sha1(f.read()).hexdigest()
+                tree_hash = hashlib.sha1(tree_data).hexdigest()
+                script_hashes = [
+                    (insertion.hash_script(script) if from_files else hashlib.sha1(script.encode("UTF-8"))).hexdigest()
+                    for script in all_scripts
+                ]
+                cached_blocks = insertion.read_manifest(manifest_file, table_hash, tree_hash)
+                cached_blocks = {
+                    block_idx: entry[1:] for block_idx, entry in cached_blocks.items()
+                    if block_idx <= len(all_scripts) and entry[0] == script_hashes[block_idx - 1]
+                }
+                manifest = (manifest_file, table_hash, tree_hash, script_hashes)
+
+            with profiler.stage("tree_build", lang):
+                SymbolLUT = cache.symbol_lut(tree_data)
+
+            # Encode and compress the scripts not found in the manifest
+            pending = [i for i in range(1, len(all_scripts) + 1) if i not in cached_blocks]
+            groups = split_groups(len(pending), jobs) if pending else []
+            for group in groups:
+                group_blocks = set(pending[group.start:group.stop])
+                scripts = [script if i in group_blocks else None for i, script in enumerate(all_scripts, start=1)]
+                tasks.append((insertion.encode_task, (scripts, tbl_trie, from_files)))
+            jobs_list.append((lang, layout, len(all_scripts), cached_blocks, manifest, len(groups), SymbolLUT,
+                              bytes(tree_data), all_scripts, tbl_trie, from_files))
+
+        with profiler.stage("encode", ",".join(langs)):
+            encoded_groups = run_tasks(executor, tasks)
+
+        tasks = []
+        encoded_blocks = {}
+        for lang, layout, script_count, cached_blocks, manifest, group_count, SymbolLUT, *_ in jobs_list:
+            encoded_blocks[lang] = {}
+            for _ in range(group_count):
+                encoded_group = encoded_groups.pop(0)
+                encoded_blocks[lang].update(encoded_group)
+                tasks.append((insertion.compress_task, (encoded_group, SymbolLUT)))
+
+        with profiler.stage("compress", ",".join(langs)):
+            results = run_tasks(executor, tasks)
+
+        manifests = []
+        writes = []
+        tasks = []
+        for lang, layout, script_count, cached_blocks, manifest, group_count, SymbolLUT, tree_data, all_scripts, tbl_trie, from_files in jobs_list:
+            PTR_START_OFFSET = layout["PTR_START_OFFSET"]
+            PTR_SIZE = layout["PTR_SIZE"]
+            TEXT_START_OFFSET = layout["TEXT_START_OFFSET"]
+            TEXT_SIZE = layout["TEXT_LIMIT"]
+
+            blocks = dict(cached_blocks)
+            for _ in range(group_count):
+                blocks.update(results.pop(0))
+            compressed_blocks = [blocks[block_idx] for block_idx in range(1, script_count + 1)]
+            compress_script, compress_script_raw_size, scripts_lengths, script_offsets = insertion.pack_blocks(compressed_blocks, BASE, dedup)
+            if dedup:
+                saved = sum(len(block_bytes) for block_bytes, _ in compressed_blocks) - compress_script_raw_size
+                print(f"[{lang}] {saved} bytes saved by sharing repeated scripts.")
+            if manifest is not None:
+                print(f"{len(cached_blocks)} of {script_count} blocks reused from {manifest[0]}.")
+                manifests.append((manifest, compressed_blocks))
+
+            stats["blocks"] += script_count
+            stats["symbols"] += sum(scripts_lengths)
+            stats["bytes"] += compress_script_raw_size
+            if profiler.enabled:
+                for block_idx, (block_bytes, symbols) in enumerate(compressed_blocks, start=1):
+                    # Blocks reused from the manifest were not encoded, their bit count is unknown
+                    block = encoded_blocks[lang].get(block_idx)
+                    bits = sum(SymbolLUT[symbol][0] for symbol in block) if block is not None else None
+                    profiler.block(lang, block_idx, symbols, bits, len(block_bytes))
+
+            # Create 4 byte pointer
+            new_ptr_table_raw_bytes, new_ptr_table_raw_bytes_size = insertion.create_4_bytes_pointers(scripts_lengths, script_offsets)
+
+            # Check raw bytes size
+            if compress_script_raw_size > TEXT_SIZE:
+                print(f"\nERROR: script size has exceeded its maximum size. Remove {compress_script_raw_size - TEXT_SIZE} bytes of excess in the block.")
+                sys.exit(1)
+            if new_ptr_table_raw_bytes_size > PTR_SIZE:
+                print(f"\nERROR: table pointer size has exceeded its maximum size. Remove {new_ptr_table_raw_bytes_size - PTR_SIZE} excess bytes.")
+                sys.exit(1)
+
+            writes.append((TEXT_START_OFFSET, TEXT_SIZE, compress_script, PTR_START_OFFSET, PTR_SIZE, new_ptr_table_raw_bytes))
+
+            # Decode the new stream again, blocks reused from the manifest are encoded for the check
+            if verify:
+                table = cache.decode_table(tree_data)
+                for group in split_groups(script_count, jobs):
+                    blocks = {
+                        block_idx: encoded_blocks[lang].get(block_idx, all_scripts[block_idx - 1])
+                        for block_idx in range(group.start + 1, group.stop + 1)
+                    }
+                    tasks.append((insertion.verify_task, (lang, table, bytes(compress_script), bytes(new_ptr_table_raw_bytes), blocks, tbl_trie,
+                                                          from_files)))
+
+        if verify:
+            with profiler.stage("verify", ",".join(langs)):
+                errors = [error for result in run_tasks(executor, tasks) for error in result]
+            if errors:
+                for error in errors:
+                    print(f"[ERROR] Verify: {error}")
+                print("\nERROR: the compressed script doesn't decode back to the input, the ROM was not written.")
+                sys.exit(1)
+            print(f"Verified {sum(job[2] for job in jobs_list)} scripts.")
+
+        # Write data to ROM and print summary
+        for TEXT_START_OFFSET, TEXT_SIZE, compress_script, PTR_START_OFFSET, PTR_SIZE, new_ptr_table_raw_bytes in writes:
+            script_freespace =  insertion.write_rom(rom, TEXT_START_OFFSET, TEXT_SIZE, compress_script, False, 0xFF)
+            print(f"Script text written to address {hex(TEXT_START_OFFSET)}, {script_freespace} bytes free.")
+            ptrs_freespace = insertion.write_rom(rom, PTR_START_OFFSET, PTR_SIZE, new_ptr_table_raw_bytes, False, 0xFF)
+            print(f"Pointer table written to address {hex(PTR_START_OFFSET)}, {ptrs_freespace//4} lines/pointers left.")
+
+        with profiler.stage("rom_write", ",".join(langs)):
+            rom.flush()
+
+    for (manifest_file, table_hash, tree_hash, script_hashes), compressed_blocks in manifests:
+        insertion.write_manifest(manifest_file, table_hash, tree_hash, {
+            block_idx: (script_hashes[block_idx - 1],) + tuple(compressed)
+            for block_idx, compressed in enumerate(compressed_blocks, start=1)
+        })
+
+    return stats
+
+def run_size_report(rom_file, tbl_file, script_file, langs, cache=None, script_format="txt", rebuild_tree=False, dedup=False,
+                    profiler=None):
+    """
+    Dry run of insert, prints the compressed size of every block and the space
+    left in the text region and pointer table. The ROM is only read. With
+    rebuild_tree, sizes are measured with the tree insert --rebuild-tree would build.
+    With dedup, the bytes shared by repeated blocks are not counted.
+
+    Returns:
+        bool: True when every language fits.
+    """
+    if cache is None:
+        cache = shared_cache()
+    if profiler is None:
+        profiler = stage_profiler()
+    fits = True
+
+    with rom_session(rom_file) as rom:
+        layouts = find_layouts(rom.data)
+        for lang in langs:
+            layout = rom_layout(layouts, lang, rom_file)
+
+            # Load Tbl
+            with profiler.stage("tbl_load", lang):
+                lang_tbl_file = lang_file(tbl_file, lang)
+                tbl_trie = cache.load_table(lang_tbl_file).trie
+
+            # Read Script and encode, the scripts are streamed into the encoder
+            with profiler.stage("encode", lang):
+                base_in_file = lang_file(script_file, lang, append=len(langs) > 1)
+                all_scripts = insertion.read_scripts(base_in_file, script_format, stream=True)
+                encoded_scripts = insertion.encode_text(all_scripts, tbl_trie)
+
+            with profiler.stage("tree_rebuild" if rebuild_tree else "tree_build", lang):
+                tree_data = rom.read(layout["TREE_START_OFFSET"], layout["TREE_SIZE"])
+                if rebuild_tree:
+                    tree_data = insertion.rebuild_tree(encoded_scripts, layout["TREE_SIZE"])
+                SymbolLUT = cache.symbol_lut(tree_data)
+            if rebuild_tree:
+                print(f"[{lang}] Sizes measured with a dictionary rebuilt from the scripts.")
+
+            # Measure
+            with profiler.stage("measure", lang):
+                report = insertion.size_report(encoded_scripts, SymbolLUT, layout["TEXT_LIMIT"], layout["PTR_SIZE"], dedup)
+
+            for i, block in enumerate(report["blocks"], start=1):
+                print(f"[{lang}] Script {i}: {block['symbols']} symbols, {block['bytes']} bytes.")
+                if profiler.enabled:
+                    bits = sum(SymbolLUT[symbol][0] for symbol in encoded_scripts[i-1])
+                    profiler.block(lang, i, block["symbols"], bits, block["bytes"])
+            if dedup:
+                print(f"[{lang}] {report['shared_bytes']} bytes saved by sharing repeated scripts.")
+            print(f"[{lang}] Text: {report['text_bytes']} / {report['text_size']} bytes, {report['text_free']} bytes free.")
+            print(f"[{lang}] Pointer table: {report['ptr_bytes']} / {report['ptr_size']} bytes, {report['ptr_free']//4} lines/pointers left.")
+            if report["text_free"] < 0:
+                print(f"ERROR: script size has exceeded its maximum size. Remove {-report['text_free']} bytes of excess in the block.")
+            if report["ptr_free"] < 0:
+                print(f"ERROR: table pointer size has exceeded its maximum size. Remove {-report['ptr_free']} excess bytes.")
+            fits = fits and report["fits"]
+
+    return fits
+
+def run_plan(rom_file, tbl_file, script_file, langs, out_tbl, rebuild_tree=False, max_length=dte_planner.MAX_LENGTH,
+             min_count=dte_planner.MIN_COUNT, max_entries=None, cache=None, script_format="txt"):
+    """
+    Plans DTE/MTE entries for the symbols of the dictionary the table doesn't
+    use and writes the table with them to out_tbl. The ROM is only read.
+
+    Returns:
+        dict: Language -> (entries, size_before, size_after), see dte_planner.plan.
+    """
+    if cache is None:
+        cache = shared_cache()
+    if len(langs) > 1 and "{lang}" not in out_tbl:
+        print("ERROR: the output table needs a {lang} placeholder with -l all.")
+        sys.exit(1)
+    plans = {}
+
+    with rom_session(rom_file) as rom:
+        layouts = find_layouts(rom.data)
+        for lang in langs:
+            layout = rom_layout(layouts, lang, rom_file)
+
+            # Load Tbl
+            lang_tbl_file = lang_file(tbl_file, lang)
+            table = cache.load_table(lang_tbl_file)
+
+            # Read Script, line by line for the substring counts
+            base_in_file = lang_file(script_file, lang, append=len(langs) > 1)
+            blocks = [[script] if isinstance(script, str) else list(script)
+                      for script in insertion.read_scripts(base_in_file, script_format, stream=True)]
+
+            # Free symbols
+            SymbolLUT = cache.symbol_lut(rom.read(layout["TREE_START_OFFSET"], layout["TREE_SIZE"]))
+            encoded_scripts = insertion.encode_text(["".join(block) for block in blocks], table.trie)
+            free = dte_planner.free_symbols(SymbolLUT, table, encoded_scripts, rebuild_tree)
+            if not free and rebuild_tree:
+                print(f"[{lang}] Every symbol of the table is used by the scripts.")
+                continue
+            if not free:
+                print(f"[{lang}] Every symbol of the dictionary is used by the table or the scripts, "
+                      f"--rebuild-tree plans entries for a new dictionary.")
+                continue
+            print(f"[{lang}] {len(free)} free symbols: {' '.join(f'{symbol:02X}' for symbol in free)}")
+
+            # Plan
+            max_symbols = (layout["TREE_SIZE"] - 2 + 5) // 10
+            entries, size_before, size_after = dte_planner.plan(blocks, table, SymbolLUT, free, rebuild_tree, max_symbols,
+                                                                max_length, min_count, max_entries)
+            plans[lang] = (entries, size_before, size_after)
+            for symbol, ngram, gain in entries:
+                print(f"[{lang}] {symbol:02X}={ngram}  ({gain} bits saved)")
+            print(f"[{lang}] Compressed text: {size_before} -> {size_after} bytes, {size_before - size_after} bytes saved.")
+
+            out_tbl_file = lang_file(out_tbl, lang)
+            dte_planner.write_tbl(lang_tbl_file, out_tbl_file, entries)
+            print(f"[{lang}] Table written to {out_tbl_file}" + (", insert with --rebuild-tree." if rebuild_tree else "."))
+
+    return plans
+
+def changed_range(old, new):
+    """
+    Returns (start, end) of the bytes of new that differ from old, None when they are equal.
+    """
+    size = min(len(old), len(new))
+    start = 0
+    while start < size and old[start] == new[start]:
+        start += 1
+    if start == len(new):
+        return None
+    end = len(new)
+    if len(new) <= len(old):
+        while end > start and old[end - 1] == new[end - 1]:
+            end -= 1
+    return start, end
+
+def run_watch(rom_file, tbl_file, script_file, langs, out_rom=None, interval=0.25, poll=False, cache=None):
+    """
+    Inserts the scripts of every language in langs, then inserts again every
+    script saved while running. The ROM, tables and trees stay in memory, only
+    the saved block is encoded again and only the changed bytes are written.
+    With out_rom, the ROM is copied and only the copy is written.
+    """
+    if cache is None:
+        cache = shared_cache()
+    with open(rom_file, "rb") as f:
+        image = bytearray(f.read())
+    if out_rom is None:
+        out_rom = rom_file
+    else:
+        with open(out_rom, "wb") as f:
+            f.write(image)
+
+    # Load every language and insert its scripts
+    texts = {}
+    scripts = {}
+    written = {}
+    for lang in langs:
+        text = Dkc3Text(bytes(image), lang, lang_file(tbl_file, lang), cache)
+        base_in_file = lang_file(script_file, lang, append=len(langs) > 1)
+        for i in range(1, text.block_count + 1):
+            script_path = os.path.abspath(f"{base_in_file}_{i}.txt")
+            text.set_block(i, insertion.iter_script(script_path))
+            scripts[script_path] = (lang, i, insertion.hash_script(script_path).digest())
+        texts[lang] = text
+        layout = text.layout
+        written[lang] = (bytes(image[layout["TEXT_START_OFFSET"]:layout["TEXT_START_OFFSET"] + layout["TEXT_LIMIT"]]),
+                         bytes(image[layout["PTR_START_OFFSET"]:layout["PTR_END_OFFSET"] + 1]))
+
+    def write_changes(lang):
+        text = texts[lang]
+        layout = text.layout
+        text_data, ptr_table = text.build()
+        old_text, old_ptr = written[lang]
+        with rom_session(out_rom, writable=True) as rom:
+            for start_offset, old, new in ((layout["TEXT_START_OFFSET"], old_text, text_data),
+                                           (layout["PTR_START_OFFSET"], old_ptr, ptr_table)):
+                changed = changed_range(old, new)
+                if changed is not None:
+                    rom.write(start_offset + changed[0], new[changed[0]:changed[1]])
+        written[lang] = (bytes(text_data) + old_text[len(text_data):], bytes(ptr_table) + old_ptr[len(ptr_table):])
+        return layout["TEXT_LIMIT"] - len(text_data)
+
+    for lang in langs:
+        try:
+            free_space = write_changes(lang)
+        except ValueError as e:
+            print(f"\nERROR: {e}.")
+            sys.exit(1)
+        print(f"Script {lang} written to {out_rom}, {free_space} bytes free.")
+
+    # Insert every saved script
+    watcher = script_watcher(scripts, interval, poll)
+    print(f"Watching {len(scripts)} scripts ({watcher.mode}), press Ctrl+C to stop.")
+    try:
+        while True:
+            for script_path in sorted(watcher.changes()):
+                start = time.perf_counter()
+                lang, i, digest = scripts[script_path]
+                try:
+                    new_digest = insertion.hash_script(script_path).digest()
+                except OSError as e:
+                    print(f"[ERROR] {script_path}: {e.strerror}")
+                    continue
+                except UnicodeDecodeError as e:
+                    print(f"[ERROR] {script_path}: {e}")
+                    continue
+                if new_digest == digest:
+                    continue
+
+                text = texts[lang]
+                previous = (text.symbols[i - 1], text.compressed[i - 1])
+                try:
+                    text.set_block(i, insertion.iter_script(script_path))
+                    free_space = write_changes(lang)
+                except (SystemExit, ValueError, OSError) as e:
+                    # Keep the last good block, the ROM is not written
+                    text.symbols[i - 1], text.compressed[i - 1] = previous
+                    text.lines[i - 1] = None
+                    if isinstance(e, ValueError):
+                        print(f"\nERROR: {e}.")
+                    elif isinstance(e, OSError):
+                        print(f"[ERROR] {script_path}: {e.strerror}")
+                    print(f"Script {script_path} not inserted.")
+                    continue
+                scripts[script_path] = (lang, i, new_digest)
+                print(f"Script {script_path} inserted in {(time.perf_counter() - start) * 1000:.1f} ms, {free_space} bytes free.")
+    except KeyboardInterrupt:
+        print("\nWatch stopped.")
+    finally:
+        watcher.close()
+
+def run_layout(rom_file):
+    """
+    Prints the layout of every language found in a ROM.
+
+    Returns:
+        bool: True when at least one language was found.
+    """
+    with rom_session(rom_file) as rom:
+        header = layout_detector.header_size(len(rom.data))
+        crc = zlib.crc32(rom.data[header:])
+        layouts = find_layouts(rom.data)
+    print(f"CRC32: {crc:08X}{' (known ROM)' if crc in KNOWN_ROMS else ''}, {'512-byte copier header' if header else 'no header'}.")
+    for lang in layouts:
+        layout = get_layout(lang, layouts[lang])
+        print(f"[{lang}] Pointer table: {hex(layout['PTR_START_OFFSET'])}-{hex(layout['PTR_END_OFFSET'])}")
+        print(f"[{lang}] Tree: {hex(layout['TREE_START_OFFSET'])}-{hex(layout['TREE_END_OFFSET'])}")
+        print(f"[{lang}] Text: {hex(layout['TEXT_START_OFFSET'])}-{hex(layout['TEXT_END_OFFSET'])}, {hex(layout['TEXT_LIMIT'])} bytes available")
+    if not layouts:
+        print(f"ERROR: no script was found in {rom_file}.")
+    return bool(layouts)
+
+def read_batch_manifest(manifest_file):
+    """
+    Reads a batch job manifest (.json or .toml).
+
+    Format:
+        {
+            "defaults": {"tbl": "dkc3_{lang}.tbl"},
+            "jobs": [
+                {"command": "extract", "rom": "a.sfc", "lang": "all", "script": "out/dkc3_script"},
+                {"command": "insert", "rom": "b.sfc", "lang": "fr", "script": "fr/dkc3_script_fr", "incremental": true}
+            ]
+        }
+
+    Every job key missing is taken from "defaults". Relative paths are resolved
+    against the directory of the manifest.
+
+    Returns:
+        list[dict]: The jobs with defaults applied.
+    """
+    if manifest_file.lower().endswith(".toml"):
+        try:
+            import tomllib
+        except ImportError:
+            print("ERROR: TOML manifests need Python 3.11 or newer, use a .json manifest.")
+            sys.exit(1)
+        with open(manifest_file, "rb") as f:
+            manifest = tomllib.load(f)
+    else:
+        with open(manifest_file, "r", encoding="UTF-8") as f:
+            manifest = json.load(f)
+
+    base_dir = os.path.dirname(os.path.abspath(manifest_file))
+    defaults = manifest.get("defaults", {})
+    jobs = []
+    for job_index, entry in enumerate(manifest.get("jobs", []), start=1):
+        job = dict(defaults)
+        job.update(entry)
+        job.setdefault("lang", "en")
+        job.setdefault("incremental", False)
+        job.setdefault("out_rom", None)
+        job.setdefault("output_patch", None)
+        job.setdefault("format", "txt")
+        job.setdefault("verify", False)
+        job.setdefault("dedup", False)
+        for key in ("command", "rom", "tbl", "script"):
+            if key not in job:
+                print(f"ERROR: batch job {job_index} has no '{key}'.")
+                sys.exit(1)
+        if job["command"] not in ("extract", "insert"):
+            print(f"ERROR: batch job {job_index} has an invalid command '{job['command']}'.")
+            sys.exit(1)
+        if job["format"] not in SCRIPT_FORMATS:
+            print(f"ERROR: batch job {job_index} has an invalid format '{job['format']}'.")
+            sys.exit(1)
+        if job["lang"] != "all" and job["lang"] not in LAYOUTS:
+            print(f"ERROR: batch job {job_index} has an invalid language '{job['lang']}'.")
+            sys.exit(1)
+        for key in ("rom", "tbl", "script", "out_rom", "output_patch"):
+            if job[key] is not None:
+                job[key] = os.path.join(base_dir, job[key])
+        jobs.append(job)
+    return jobs
+
+def run_batch(manifest_file, jobs=1, executor=None):
+    """
+    Runs every extract/insert job of a batch manifest in this process.
+
+    Parsed tables and decoded trees are shared between the jobs. A failing job
+    is reported and the batch goes on with the next one.
+
+    Returns:
+        int: Number of failed jobs.
+    """
+    cache = shared_cache()
+    batch_jobs = read_batch_manifest(manifest_file)
+    failed = 0
+
+    for job_index, job in enumerate(batch_jobs, start=1):
+        langs = list(LAYOUTS) if job["lang"] == "all" else [job["lang"]]
+        print(f"--- Job {job_index}/{len(batch_jobs)}: {job['command']} {job['lang']} {job['rom']}")
+        start_time = time.perf_counter()
+        try:
+            if job["command"] == "extract":
+                stats = run_extract(job["rom"], job["tbl"], job["script"], langs, jobs, executor, cache, script_format=job["format"])
+            else:
+                stats = run_insert(job["rom"], job["tbl"], job["script"], langs, job["incremental"], jobs, executor, cache,
+                                   out_rom=job["out_rom"], output_patch=job["output_patch"], script_format=job["format"],
+                                   verify=job["verify"], dedup=job["dedup"])
+        except (OSError, ValueError) as e:
+            failed += 1
+            print(f"ERROR: {e}\nJob {job_index} failed.\n")
+            continue
+        except SystemExit:
+            failed += 1
+            print(f"Job {job_index} failed.\n")
+            continue
+        elapsed = max(time.perf_counter() - start_time, 1e-9)
+        print(f"Job {job_index}: {stats['blocks']} blocks, {stats['symbols']} symbols, {stats['bytes']} bytes in {elapsed:.3f} s "
+              f"({stats['symbols'] / elapsed:.0f} symbols/s, {stats['bytes'] / elapsed / 1024:.1f} KiB/s).\n")
+
+    print(f"Batch complete: {len(batch_jobs) - failed} of {len(batch_jobs)} jobs succeeded.")
+    return failed
+
 def main():
     parser = argparse.ArgumentParser(
         description="Donkey Kong Country 3 text editor by koda v0.1"
     )
 
     subparsers = parser.add_subparsers(dest="command", help="Commands")
+    lang_choices = list(LAYOUTS) + ["all"]
 
     # --- extract ---
     extract_parser = subparsers.add_parser("extract", help="Extract text from ROM")
-    extract_parser.add_argument("-l", "--lang", default="en", choices=["en", "fr"],
+    extract_parser.add_argument("-l", "--lang", default="en", choices=lang_choices,
                                 help="Language (default: en)")
     extract_parser.add_argument("-r", "--romFile", required=True,
                                 help="ROM file path")
     extract_parser.add_argument("-f", "--outFile", required=True,
                                 help="Output text file")
     extract_parser.add_argument("-t", "--tblFile", required=True,
-                                help="Table (.tbl) file")
+                                help="Table (.tbl) file, {lang} is replaced by the language")
+    extract_parser.add_argument("--format", default="txt", choices=SCRIPT_FORMATS,
+                                help="Script format: one .txt file per script, or one .jsonl/.po file per language (default: txt)")
+    extract_parser.add_argument("--index", action="store_true",
+                                help="Write the line index of every language to <outFile>_<lang>.idx")
+    extract_parser.add_argument("-j", "--jobs", type=int, default=1,
+                                help="Worker processes, 0 uses every core (default: 1)")
+    extract_parser.add_argument("--profile", metavar="REPORT",
+                                help="Write the time and CPU of every stage to a JSON report")
+    extract_parser.add_argument("--profile-memory", action="store_true",
+                                help="With --profile, trace the peak memory of every stage too (slower, times are not comparable)")
+    extract_parser.add_argument("--cprofile", metavar="FILE",
+                                help="Write cProfile statistics (pstats format) to FILE")
 
     # --- insert ---
     insert_parser = subparsers.add_parser("insert", help="Insert text into ROM")
-    insert_parser.add_argument("-l", "--lang", default="en", choices=["en", "fr"],
+    insert_parser.add_argument("-l", "--lang", default="en", choices=lang_choices,
                                help="Language (default: en)")
     insert_parser.add_argument("-r", "--romFile", required=True,
                                help="ROM file path")
     insert_parser.add_argument("-f", "--inFile", required=True,
-                               help="Input text file")
+                               help="Input text file, {lang} is replaced by the language")
     insert_parser.add_argument("-t", "--tblFile", required=True,
-                               help="Table (.tbl) file")
+                               help="Table (.tbl) file, {lang} is replaced by the language")
+    insert_parser.add_argument("--format", default="txt", choices=SCRIPT_FORMATS,
+                               help="Script format: one .txt file per script, or one .jsonl/.po file per language (default: txt)")
+    insert_parser.add_argument("--incremental", action="store_true",
+                               help="Only recompress scripts changed since the last insert (cache stored in <inFile>.manifest.json)")
+    insert_parser.add_argument("-j", "--jobs", type=int, default=1,
+                               help="Worker processes, 0 uses every core (default: 1)")
+    insert_parser.add_argument("--rebuild-tree", action="store_true",
+                               help="Build a new Huffman dictionary from the scripts and write it to the ROM")
+    insert_parser.add_argument("--profile", metavar="REPORT",
+                               help="Write the time and CPU of every stage to a JSON report")
+    insert_parser.add_argument("--profile-memory", action="store_true",
+                               help="With --profile, trace the peak memory of every stage too (slower, times are not comparable)")
+    insert_parser.add_argument("--cprofile", metavar="FILE",
+                               help="Write cProfile statistics (pstats format) to FILE")
+    insert_parser.add_argument("--dry-run", action="store_true",
+                               help="Only report the compressed size of every script, the ROM is not written")
+    insert_parser.add_argument("--dedup", action="store_true",
+                               help="Store scripts found in other scripts (repeated text) only once")
+    insert_parser.add_argument("--verify", action="store_true",
+                               help="Decode the compressed scripts in memory and compare them with the input before writing")
+    insert_parser.add_argument("--out-rom",
+                               help="Write the patched ROM to this file, the ROM file is not modified")
+    insert_parser.add_argument("--output-patch", metavar="PATCH",
+                               help="Write the changes as an IPS (.ips) or BPS (.bps) patch, the ROM file is not modified")
+
+    # --- batch ---
+    batch_parser = subparsers.add_parser("batch", help="Run every job of a manifest (.json/.toml)")
+    batch_parser.add_argument("manifest",
+                              help="Job manifest file")
+    batch_parser.add_argument("-j", "--jobs", type=int, default=1,
+                              help="Worker processes, 0 uses every core (default: 1)")
+
+    # --- layout ---
+    layout_parser = subparsers.add_parser("layout", help="Show the script layout found in a ROM")
+    layout_parser.add_argument("-r", "--romFile", required=True,
+                               help="ROM file path")
+
+    # --- watch ---
+    watch_parser = subparsers.add_parser("watch", help="Insert the scripts again every time one is saved")
+    watch_parser.add_argument("-l", "--lang", default="en", choices=lang_choices,
+                              help="Language (default: en)")
+    watch_parser.add_argument("-r", "--romFile", required=True,
+                              help="ROM file path")
+    watch_parser.add_argument("-f", "--inFile", required=True,
+                              help="Input text file, {lang} is replaced by the language")
+    watch_parser.add_argument("-t", "--tblFile", required=True,
+                              help="Table (.tbl) file, {lang} is replaced by the language")
+    watch_parser.add_argument("--out-rom",
+                              help="Write a copy of the ROM instead of the ROM file")
+    watch_parser.add_argument("--interval", type=float, default=0.25,
+                              help="Seconds between checks when polling (default: 0.25)")
+    watch_parser.add_argument("--poll", action="store_true",
+                              help="Poll the scripts instead of using inotify")
+
+    # --- plan ---
+    plan_parser = subparsers.add_parser("plan", help="Plan DTE/MTE table entries for the unused dictionary symbols")
+    plan_parser.add_argument("-l", "--lang", default="en", choices=lang_choices,
+                             help="Language (default: en)")
+    plan_parser.add_argument("-r", "--romFile", required=True,
+                             help="ROM file path")
+    plan_parser.add_argument("-f", "--inFile", required=True,
+                             help="Input text file, {lang} is replaced by the language")
+    plan_parser.add_argument("-t", "--tblFile", required=True,
+                             help="Table (.tbl) file, {lang} is replaced by the language")
+    plan_parser.add_argument("-o", "--outTbl", required=True,
+                             help="Output table file with the new entries, {lang} is replaced by the language")
+    plan_parser.add_argument("--format", default="txt", choices=SCRIPT_FORMATS,
+                             help="Script format: one .txt file per script, or one .jsonl/.po file per language (default: txt)")
+    plan_parser.add_argument("--rebuild-tree", action="store_true",
+                             help="Plan for a dictionary rebuilt by insert --rebuild-tree, the table symbols the scripts don't use are free")
+    plan_parser.add_argument("--max-length", type=int, default=dte_planner.MAX_LENGTH,
+                             help=f"Longest substring of an entry (default: {dte_planner.MAX_LENGTH})")
+    plan_parser.add_argument("--min-count", type=int, default=dte_planner.MIN_COUNT,
+                             help=f"Fewest occurrences of a substring (default: {dte_planner.MIN_COUNT})")
+    plan_parser.add_argument("--entries", type=int,
+                             help="Most entries to add (default: every free symbol)")
 
     # Version
     #parser.add_argument("-v", "--version", action="version",
@@ -501,142 +3809,67 @@ def main():
         parser.print_help()
         sys.exit(1)
 
-    if args.command == "extract":
-        rom_file = args.romFile
-        tbl_file = args.tblFile
-        out_file = args.outFile
-        lang = args.lang
-        if lang == 'en':
-            PTR_START_OFFSET = 0x379DF5
-            PTR_END_OFFSET = 0x379E44
-            PTR_SIZE = PTR_END_OFFSET - PTR_START_OFFSET + 1
-            TREE_START_OFFSET = 0x379EE5
-            TREE_END_OFFSET = 0x37A1E4
-            TREE_SIZE = TREE_END_OFFSET - TREE_START_OFFSET + 1
-            BASE = 0x3A0000
-            TEXT_START_OFFSET = 0x3A0000
-            TEXT_END_OFFSET = 0x3A5392
-            TEXT_SIZE = TEXT_END_OFFSET - TEXT_START_OFFSET + 1
-        elif lang == 'fr':
-            PTR_START_OFFSET = 0x379E45
-            PTR_END_OFFSET = 0x379E94
-            PTR_SIZE = PTR_END_OFFSET - PTR_START_OFFSET + 1
-            TREE_START_OFFSET = 0x37A1E5
-            TREE_END_OFFSET = 0x37A570
-            TREE_SIZE = TREE_END_OFFSET - TREE_START_OFFSET + 1
-            BASE = 0x3A5393
-            TEXT_START_OFFSET = 0x3A5393
-            TEXT_END_OFFSET = 0x3AA1B2
-            TEXT_SIZE = TEXT_END_OFFSET - TEXT_START_OFFSET + 1
-        else:
-            print("Invalid Language Exiting...")
-            sys.exit(1)
-
-        # Load class
-        extract = extraction()
+    langs = list(LAYOUTS) if getattr(args, "lang", None) == "all" else [getattr(args, "lang", None)]
+    jobs = getattr(args, "jobs", 1)
+    jobs = jobs if jobs > 0 else (os.cpu_count() or 1)
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=extraction.init_worker) if jobs > 1 else None
+    profiler = stage_profiler(enabled=bool(getattr(args, "profile", None)), memory=getattr(args, "profile_memory", False))
+    cprofiler = cProfile.Profile() if getattr(args, "cprofile", None) else None
+    if cprofiler is not None:
+        cprofiler.enable()
+
+    try:
+        if args.command == "extract":
+            run_extract(args.romFile, args.tblFile, args.outFile, langs, jobs, executor, profiler=profiler, script_format=args.format,
+                        index=args.index)
+
+        elif args.command == "insert" and args.dry_run:
+            if not run_size_report(args.romFile, args.tblFile, args.inFile, langs, script_format=args.format,
+                                   rebuild_tree=args.rebuild_tree, dedup=args.dedup, profiler=profiler):
+                sys.exit(1)
+
+        elif args.command == "insert":
+            if args.output_patch and not args.output_patch.lower().endswith((".ips", ".bps")):
+                print("ERROR: the patch file must end with .ips or .bps.")
+                sys.exit(1)
+            try:
+                run_insert(args.romFile, args.tblFile, args.inFile, langs, args.incremental, jobs, executor,
+                           rebuild_tree=args.rebuild_tree, profiler=profiler, out_rom=args.out_rom, output_patch=args.output_patch,
+                           script_format=args.format, verify=args.verify,
+                           dedup=args.dedup)
+            except ValueError as e:
+                print(f"ERROR: {e}.")
+                sys.exit(1)
+
+        elif args.command == "batch":
+            if run_batch(args.manifest, jobs, executor):
+                sys.exit(1)
+
+        elif args.command == "layout":
+            if not run_layout(args.romFile):
+                sys.exit(1)
+
+        elif args.command == "plan":
+            run_plan(args.romFile, args.tblFile, args.inFile, langs, args.outTbl, args.rebuild_tree, args.max_length,
+                     args.min_count, args.entries, script_format=args.format)
+
+        elif args.command == "watch":
+            run_watch(args.romFile, args.tblFile, args.inFile, langs, args.out_rom, args.interval, args.poll)
 
-        # Load Tbl
-        tbl_dict = extraction.read_tbl(tbl_file)
-
-        # Get Pointers
-        ptr_table = extraction.read_rom(rom_file, PTR_START_OFFSET, PTR_SIZE)  
-
-        # Split ptr and lenghts
-        ptr_array, length_array = extraction.read_ptr_table(ptr_table, BASE)
-        ptr_array = reverse_list(ptr_array)
-        length_array = reverse_list(length_array)
-        
-        # Decomprees
-        decompress_blocks = extraction.huffman_decompress(rom_file, tbl_dict, TREE_START_OFFSET, TREE_SIZE, ptr_array, length_array)
-
-        # Write script
-        base_out_file = out_file
-
-        for i, block_text in enumerate(decompress_blocks, start=1):
-            out_file_i = f"{base_out_file}_{lang}_{i}.txt"
-            extraction.write_out_file(out_file_i, block_text, ptr_array[i-1], length_array[i-1])
-            print(f"Text extracted to {out_file_i}")
-        print(f"TEXT BLOCK SIZE: {TEXT_SIZE} / {hex(TEXT_SIZE)} bytes.")
-        print(f"PTR_TABLE BLOCK SIZE: {PTR_SIZE} / {hex(PTR_SIZE)} bytes.")     
-        print("Extraction complete.\n")
-       
-    elif args.command == "insert":
-        rom_file = args.romFile
-        tbl_file = args.tblFile
-        script_file = args.inFile
-        lang = args.lang
-        if lang == 'en':
-            PTR_START_OFFSET = 0x379DF5
-            PTR_END_OFFSET = 0x379E44
-            PTR_SIZE = PTR_END_OFFSET - PTR_START_OFFSET + 1
-            #75 different characters
-            TREE_START_OFFSET = 0x379EE5
-            TREE_END_OFFSET = 0x37A1E4
-            TREE_SIZE = TREE_END_OFFSET - TREE_START_OFFSET + 1
-            BASE = 0x0
-            TEXT_START_OFFSET = 0x3A0000
-            TEXT_END_OFFSET = 0x3A5392
-            TEXT_SIZE = TEXT_END_OFFSET - TEXT_START_OFFSET + 1
-            
-        elif lang == 'fr':          
-            PTR_START_OFFSET = 0x379E45
-            PTR_END_OFFSET = 0x379E94
-            PTR_SIZE = PTR_END_OFFSET - PTR_START_OFFSET + 1
-            #90 different characters
-            TREE_START_OFFSET = 0x37A1E5
-            TREE_END_OFFSET = 0x37A570
-            TREE_SIZE = TREE_END_OFFSET - TREE_START_OFFSET + 1
-            BASE = 0x0
-            TEXT_START_OFFSET = 0x3A5393
-            TEXT_END_OFFSET = 0x3AA1B2
-            TEXT_SIZE = TEXT_END_OFFSET - TEXT_START_OFFSET + 1
-            TEXT_SIZE = 0x6000
         else:
-            print("Invalid Language Exiting...")
-            sys.exit(1)
-            
-        # Load class
-        insert = insertion()
-
-        # Load Tbl
-        tbl_dict, byte_lenghts = insertion.read_tbl(tbl_file)
-
-        # Read Script
-        base_in_file = script_file        
-        all_scripts = []
-        for i in range(1, 21):
-            script_path = f"{base_in_file}_{i}.txt"
-            script_data = insertion.read_script(script_path)
-            all_scripts.append(script_data)
-
-        # Encode Scripts
-        encoded_scripts = insertion.encode_text(all_scripts, tbl_dict, byte_lenghts)
-        
-        # Compress
-        compress_script, compress_script_raw_size, scripts_lengths, script_offsets = insertion.huffman_compress(encoded_scripts, rom_file, TREE_START_OFFSET, TREE_SIZE, BASE)
-        
-        # Create 4 byte pointer
-        new_ptr_table_raw_bytes, new_ptr_table_raw_bytes_size = insertion.create_4_bytes_pointers(scripts_lengths, script_offsets)
-
-        # Check raw bytes size
-        if compress_script_raw_size > TEXT_SIZE:
-            print(f"\nERROR: script size has exceeded its maximum size. Remove {compress_script_raw_size - TEXT_SIZE} bytes of excess in the block.")
+            sys.stdout.write("Usage: extract <romFile> <outFile> <tblFile>\n")
+            sys.stdout.write("       insert <outFile> <romFile> <tblFile>\n")
+            sys.stdout.write("       -v show version.\n")
             sys.exit(1)
-        if new_ptr_table_raw_bytes_size > PTR_SIZE:
-            print(f"\nERROR: table pointer size has exceeded its maximum size. Remove {new_ptr_table_raw_bytes_size - PTR_SIZE} excess bytes.")
-            sys.exit(1)
-
-        # Write data to ROM and print summary
-        script_freespace =  insertion.write_rom(rom_file, TEXT_START_OFFSET, TEXT_SIZE, compress_script, False, 0xFF)
-        print(f"Script text written to address {hex(TEXT_START_OFFSET)}, {script_freespace} bytes free.")
-        ptrs_freespace = insertion.write_rom(rom_file, PTR_START_OFFSET, PTR_SIZE, new_ptr_table_raw_bytes, False, 0xFF)
-        print(f"Pointer table written to address {hex(PTR_START_OFFSET)}, {ptrs_freespace//4} lines/pointers left.")
-        
-    else:
-        sys.stdout.write("Usage: extract <romFile> <outFile> <tblFile>\n")
-        sys.stdout.write("       insert <outFile> <romFile> <tblFile>\n")
-        sys.stdout.write("       -v show version.\n")
-        sys.exit(1)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        if cprofiler is not None:
+            cprofiler.disable()
+            cprofiler.dump_stats(args.cprofile)
+            print(f"cProfile statistics written to {args.cprofile}")
+        if profiler.enabled:
+            profiler.write(args.profile, args.command)
 
 if __name__ == "__main__":
     main()